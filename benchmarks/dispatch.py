@@ -0,0 +1,45 @@
+"""Measure requests per second for a trivial resource.
+
+Run with: python -m benchmarks.dispatch
+"""
+import timeit
+
+from flask import Flask
+
+from flask_restler import Api, Resource
+
+
+NUMBER = 5000
+
+app = Flask(__name__)
+api = Api('Benchmark', __name__, url_prefix='/api')
+
+
+@api.route
+class ItemResource(Resource):
+
+    methods = 'get', 'post'
+
+    class Meta:
+        sorting = 'name', 'id'
+
+    def get_many(self, **kwargs):
+        return [{'id': num, 'name': str(num)} for num in range(10)]
+
+    def post(self, **kwargs):
+        return {'ok': True}
+
+
+api.register(app)
+client = app.test_client()
+
+
+def run(name, stmt):
+    seconds = timeit.timeit(stmt, number=NUMBER)
+    print('%-20s %8.0f req/s' % (name, NUMBER / seconds))
+
+
+if __name__ == '__main__':
+    run('GET list', lambda: client.get('/api/item?sort=-name'))
+    run('GET detail', lambda: client.get('/api/item/1'))
+    run('POST', lambda: client.post('/api/item'))
@@ -0,0 +1,78 @@
+"""Compare model and rows read modes of Peewee resources on a 100k rows table.
+
+Run with: python -m benchmarks.peewee
+"""
+import datetime as dt
+import timeit
+
+import peewee as pw
+from flask import Flask
+
+from flask_restler import Api
+from flask_restler.peewee import ModelResource
+
+
+NUMBER = 10
+ROWS = 100000
+
+database = pw.SqliteDatabase(':memory:')
+
+
+class User(pw.Model):
+
+    login = pw.CharField()
+    name = pw.CharField(null=True)
+    rating = pw.FloatField(default=0)
+    is_active = pw.BooleanField(default=True)
+    created = pw.DateTimeField(default=dt.datetime.utcnow)
+
+    class Meta:
+        database = database
+
+
+database.create_tables([User])
+with database.atomic():
+    for num in range(0, ROWS, 1000):
+        User.insert_many([
+            {'login': 'user%d' % idx, 'name': 'User %d' % idx, 'rating': idx / 3.0}
+            for idx in range(num, num + 1000)]).execute()
+
+
+app = Flask(__name__)
+api = Api('Benchmark', __name__, url_prefix='/api')
+
+
+@api.route
+class ModelsResource(ModelResource):
+
+    class Meta:
+        model = User
+        name = 'models'
+        per_page = ROWS
+
+
+@api.route
+class RowsResource(ModelResource):
+
+    class Meta:
+        model = User
+        name = 'rows'
+        per_page = ROWS
+        read_mode = 'rows'
+        compile_schema = True
+
+
+api.register(app)
+
+
+def run(name, Resource, per_page):
+    args = {'per_page': per_page}
+    with app.app_context():
+        seconds = timeit.timeit(lambda: api.call(Resource, args=args), number=NUMBER)
+    print('%-8s per_page=%-6d %8.0f rows/s' % (name, per_page, NUMBER * per_page / seconds))
+
+
+if __name__ == '__main__':
+    for per_page in (100, 1000, ROWS):
+        run('models', ModelsResource, per_page)
+        run('rows', RowsResource, per_page)
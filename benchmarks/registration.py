@@ -0,0 +1,41 @@
+"""Measure startup time of routing many resources before and after Api.register.
+
+Run with: python -m benchmarks.registration
+"""
+import timeit
+
+from flask import Flask
+
+from flask_restler import Api, Resource
+
+
+NUMBER = 5
+RESOURCES = 500
+
+
+def make_resources():
+    return [type('Item%dResource' % num, (Resource,), {'methods': ('get', 'post')})
+            for num in range(RESOURCES)]
+
+
+def route(register_first):
+    app = Flask(__name__)
+    api = Api('Benchmark', __name__, url_prefix='/api')
+    if register_first:
+        api.register(app)
+
+    for resource in make_resources():
+        api.route(resource)
+
+    if not register_first:
+        api.register(app)
+
+
+def run(name, stmt, number=NUMBER):
+    seconds = timeit.timeit(stmt, number=number)
+    print('%-20s %8.3f s per %d resources' % (name, seconds / number, RESOURCES))
+
+
+if __name__ == '__main__':
+    run('route, register', lambda: route(False))
+    run('register, route', lambda: route(True))
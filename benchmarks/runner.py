@@ -0,0 +1,43 @@
+"""Compare Api.run, Api.call and Api.run_many.
+
+Run with: python -m benchmarks.runner
+"""
+import timeit
+
+from flask import Flask
+
+from flask_restler import Api, Resource
+from flask_restler.filters import Filter
+
+
+NUMBER = 10000
+
+app = Flask(__name__)
+api = Api('Benchmark', __name__, url_prefix='/api')
+
+DATA = list(range(10))
+
+
+@api.route
+class NumResource(Resource):
+
+    class Meta:
+        filters = Filter('num'),
+
+    def get_many(self, **kwargs):
+        return DATA
+
+
+api.register(app)
+
+
+def run(name, stmt, number=NUMBER):
+    seconds = timeit.timeit(stmt, number=number)
+    print('%-12s %8.0f calls/s' % (name, NUMBER / seconds))
+
+
+if __name__ == '__main__':
+    query = {'where': {'num': {'$ge': 5}}}
+    run('run', lambda: api.run(NumResource, query_string=dict(query)))
+    run('call', lambda: api.call(NumResource, args=query))
+    run('run_many', lambda: api.run_many([(NumResource, {'args': query})] * 100), NUMBER // 100)
@@ -0,0 +1,40 @@
+"""Compare marshmallow dump and the compiled schema dump.
+
+Run with: python -m benchmarks.schema
+"""
+import datetime as dt
+import timeit
+
+import marshmallow as ma
+
+from flask_restler.compiler import compile_schema
+from flask_restler.fields import Timestamp
+
+
+NUMBER = 20
+
+ROWS = [{
+    'id': num, 'name': 'user%d' % num, 'email': 'user%d@example.com' % num,
+    'rating': num / 3.0, 'is_active': bool(num % 2), 'created': dt.datetime(2018, 12, 20),
+} for num in range(10000)]
+
+
+class UserSchema(ma.Schema):
+    id = ma.fields.Integer()
+    name = ma.fields.String()
+    email = ma.fields.String()
+    rating = ma.fields.Float()
+    is_active = ma.fields.Boolean()
+    created = Timestamp()
+
+
+def run(name, stmt, number=NUMBER):
+    seconds = timeit.timeit(stmt, number=number)
+    print('%-12s %8.0f rows/s' % (name, number * len(ROWS) / seconds))
+
+
+if __name__ == '__main__':
+    schema, dump = UserSchema(), compile_schema(UserSchema)
+    assert dump(schema, ROWS, many=True) == schema.dump(ROWS, many=True).data
+    run('marshmallow', lambda: schema.dump(ROWS, many=True))
+    run('compiled', lambda: dump(schema, ROWS, many=True))
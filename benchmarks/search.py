@@ -0,0 +1,74 @@
+"""Compare `$ilike` filter and FTS5 search (`q` param) on a 100k rows SQLite table.
+
+Run with: python -m benchmarks.search
+"""
+import random
+import timeit
+
+import peewee as pw
+from flask import Flask
+from playhouse.sqlite_ext import FTS5Model, SearchField
+
+from flask_restler import Api
+from flask_restler.peewee import ModelResource
+
+
+NUMBER = 20
+ROWS = 100000
+WORDS = ['word%d' % num for num in range(1000)]
+
+database = pw.SqliteDatabase(':memory:')
+
+
+class Article(pw.Model):
+
+    title = pw.CharField()
+
+    class Meta:
+        database = database
+
+
+class ArticleIndex(FTS5Model):
+
+    title = SearchField()
+
+    class Meta:
+        database = database
+
+
+database.create_tables([Article, ArticleIndex])
+random.seed(0)
+with database.atomic():
+    for num in range(0, ROWS, 1000):
+        titles = [' '.join(random.sample(WORDS, 8)) for _ in range(1000)]
+        Article.insert_many([{'title': title} for title in titles]).execute()
+    ArticleIndex.insert_from(Article.select(Article.id, Article.title), [
+        ArticleIndex.rowid, ArticleIndex.title]).execute()
+
+
+app = Flask(__name__)
+api = Api('Benchmark', __name__, url_prefix='/api')
+
+
+@api.route
+class ArticleResource(ModelResource):
+
+    class Meta:
+        model = Article
+        filters = 'title',
+        search = ArticleIndex
+        per_page = 20
+
+
+api.register(app)
+
+
+def run(name, args):
+    with app.app_context():
+        seconds = timeit.timeit(lambda: api.call(ArticleResource, args=args), number=NUMBER)
+    print('%-8s %8.1f requests/s' % (name, NUMBER / seconds))
+
+
+if __name__ == '__main__':
+    run('ilike', {'where': {'title': {'$ilike': '%word42 %'}}})
+    run('fts5', {'q': 'word42'})
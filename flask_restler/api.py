@@ -1,20 +1,34 @@
 from __future__ import absolute_import
 
-from flask import Blueprint, jsonify, request, render_template, json, Response
+from flask import (
+    Blueprint, jsonify, request, render_template, json, Response, current_app, session)
 from flask._compat import string_types, PY2
 import os
 import urllib
 import warnings
+from collections import OrderedDict
 from inspect import isclass
 
-from . import APIError
+from werkzeug.exceptions import HTTPException
+from werkzeug.urls import url_decode
+
+from . import APIError, compress, logger
+from .indexes import check_indexes
+from .limits import Limit
+from .runner import Runner
 from .auth import current_user
 
 from .resource import Resource
+from .serializers import JSON, NDJSON, CSV, Serializer
 from apispec import APISpec
 from apispec.ext.marshmallow import MarshmallowPlugin
 #  from apispec.ext.marshmallow.swagger import schema2jsonschema
 
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
 if PY2:
     urlencode = urllib.urlencode
 else:
@@ -24,16 +38,43 @@ else:
 DEFAULT = object()
 STATIC = os.path.abspath(os.path.join(os.path.dirname(__file__), 'static'))
 TEMPLATE = os.path.abspath(os.path.join(os.path.dirname(__file__), 'templates'))
+PRECOMPRESSED = 'static', 'specs_view', 'specs_html'
 
 
 class Api(Blueprint):
 
     """Implement REST API."""
 
-    def __init__(self, name, import_name, specs=True, version="1", url_prefix=None, **kwargs):
+    def __init__(self, name, import_name, specs=True, version="1", url_prefix=None,
+                 serializers=None, compress=False, compress_min_size=500, compress_level=6,
+                 concurrency=None, concurrency_timeout=0.1, batch=False, batch_limit=50,
+                 batch_workers=None, warn_indexes=False, **kwargs):
         self.version = version
         self.specs = specs
 
+        # Log filters and sortings which can't use indexes when resources are connected
+        self.warn_indexes = warn_indexes
+
+        # Run many API calls in one request (POST /_batch)
+        self.batch = batch
+        self.batch_limit = batch_limit
+        self.batch_workers = batch_workers
+        self.batch_resource = None
+        self.specs_resources = []
+
+        # Limit concurrent requests for the whole API
+        self.limit = concurrency and Limit(concurrency, concurrency_timeout) or None
+
+        # Compress responses by Accept-Encoding
+        self.compress = compress
+        self.compress_min_size = compress_min_size
+        self.compress_level = compress_level
+        self.compressed = {}
+
+        # Response formats, JSON is the default one
+        self.serializers = OrderedDict(
+            (s.mimetype, s) for s in [JSON, NDJSON, CSV] + list(serializers or []))
+
         if not url_prefix and version:
             url_prefix = "/%s" % version
 
@@ -43,22 +84,45 @@ class Api(Blueprint):
 
         super(Api, self).__init__(name, import_name, url_prefix=url_prefix, **kwargs)
         self.app = None
+        self.state = None
         self.resources = []
 
+        if self.compress:
+            self.after_request(self.compress_response)
+
     def register(self, app, options=None, first_registration=False):
         """Register self to application."""
         self.app = app
         app.errorhandler(APIError)(self.handle_error)
         if self.specs:
-            self.route('/_specs', params=dict(authorize=anonimous, update_specs=anonimous))(
-                self.specs_view)
+            specs_view = self.route(
+                '/_specs', params=dict(authorize=anonimous, update_specs=anonimous))(
+                    self.specs_view)
 
             @self.route('/', params=dict(authorize=anonimous, update_specs=anonimous))
             def specs_html(*args, **kwargs): # noqa
                 return Response(render_template('swagger.html'))
 
+            self.specs_resources = [specs_view, specs_html]
+
+        if self.batch and self.batch_resource is None:
+            self.batch_resource = self.route(
+                '/_batch', methods=['POST'], url_detail=None,
+                params=dict(dispatch_request=unlimited, update_specs=anonimous))(self.batch_view)
+
         return super(Api, self).register(app, options or {}, first_registration)
 
+    def make_setup_state(self, app, options, first_registration=False):
+        """Keep the setup state to connect resources added after the registration."""
+        self.state = super(Api, self).make_setup_state(app, options, first_registration)
+        return self.state
+
+    def record(self, func):
+        """Apply the deferred function immediately if the API is already registered."""
+        super(Api, self).record(func)
+        if self.state is not None:
+            func(self.state)
+
     def authorize(self, *args, **kwargs):
         """Make authorization process.
 
@@ -75,6 +139,47 @@ class Api(Blueprint):
     def handle_error(error):
         response = jsonify(error.to_dict())
         response.status_code = error.status_code
+        if error.headers:
+            response.headers.extend(error.headers)
+        return response
+
+    def compress_response(self, response):
+        """Compress the response by Accept-Encoding.
+
+        Precompressed variants for the specs and static files are cached.
+        """
+        if response.status_code != 200 or 'Content-Encoding' in response.headers:
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = compress.negotiate(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        endpoint = (request.endpoint or '').rsplit('.', 1)[-1]
+        if response.is_streamed and endpoint not in PRECOMPRESSED:
+            response.response = compress.compress_stream(
+                response.response, encoding, self.compress_level)
+            response.headers.pop('Content-Length', None)
+            response.headers['Content-Encoding'] = encoding
+            return response
+
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < self.compress_min_size:
+            return response
+
+        if endpoint in PRECOMPRESSED:
+            key = request.path, encoding
+            source, compressed = self.compressed.get(key, (None, None))
+            if source != data:
+                compressed = compress.compress(data, encoding, self.compress_level)
+                self.compressed[key] = data, compressed
+        else:
+            compressed = compress.compress(data, encoding, self.compress_level)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
         return response
 
     def connect(self, *args, **kwargs):
@@ -112,8 +217,9 @@ class Api(Blueprint):
             if url_detail:
                 api.add_url_rule(url_detail_, view_func=view_func, **options)
 
-            if api.app is not None:
-                Blueprint.register(api, api.app, {}, False)
+            if api.warn_indexes:
+                for scan in api.check_indexes(res):
+                    logger.warning('Index check: %s', scan['message'])
 
             return res
 
@@ -125,6 +231,20 @@ class Api(Blueprint):
 
         return wrapper
 
+    def check_indexes(self, *resources):
+        """Report filters and sortings which can't use database indexes.
+
+        Check all connected resources by default.
+        """
+        report = []
+        for resource in resources or self.resources:
+            try:
+                report.extend(check_indexes(resource))
+            except Exception as exc:
+                logger.warning('Index check: %s: failed to load indexes (%s)',
+                               resource.meta.name, exc)
+        return report
+
     def run(self, Resource, path=None, query_string=None, kwargs=None, **rkwargs):
         """Run given resource manually.
 
@@ -147,9 +267,105 @@ class Api(Blueprint):
             kwargs = kwargs or {}
             return resource.dispatch_request(**kwargs)
 
+    def call(self, Resource, method='GET', path='/', args=None, data=None, kwargs=None):
+        """Call given resource directly.
+
+        It's much faster than `Api.run` because it skips building WSGI environ.
+
+        :param args: Parsed query params (`where` could be a dict)
+        :param data: Parsed request body
+        """
+        with Runner(self) as run:
+            return run(Resource, method, path, args, data, kwargs)
+
+    def run_many(self, calls):
+        """Call many resources in one context.
+
+        :param calls: A list of (Resource, params) where params are `Api.call` keyword arguments
+        """
+        with Runner(self) as run:
+            return [run(Resource, **params) for Resource, params in calls]
+
+    def batch_view(self, *args, **kwargs):
+        """Run many API calls in one request.
+
+        The body is a list of calls:
+        `{"method": "GET", "path": "/v1/user", "args": {}, "body": {}}`.
+        The response is a list of `{"status": 200, "headers": {}, "body": ...}` in the same
+        order.
+        """
+        calls = request.json
+        if not isinstance(calls, list) or not all(isinstance(call, dict) for call in calls):
+            raise APIError('Batch should be a list of calls.')
+
+        if len(calls) > self.batch_limit:
+            raise APIError('Batch is too large (max %d calls).' % self.batch_limit, 413)
+
+        adapter = current_app.create_url_adapter(request)
+        params = dict(headers=request.headers, remote_addr=request.remote_addr,
+                      session=session._get_current_object(), url_adapter=adapter)
+
+        if not self.batch_workers or ThreadPoolExecutor is None or len(calls) < 2:
+            with Runner(self, **params) as run:
+                return [self.batch_call(run, adapter, call) for call in calls]
+
+        def worker(call):
+            with Runner(self, **params) as run:
+                return self.batch_call(run, adapter, call)
+
+        with ThreadPoolExecutor(min(self.batch_workers, len(calls))) as executor:
+            return list(executor.map(worker, calls))
+
+    def batch_call(self, run, adapter, call):
+        """Run a call from a batch."""
+        method = str(call.get('method', 'GET')).upper()
+        path, _, query_string = str(call.get('path', '')).partition('?')
+        headers = {}
+
+        try:
+            if not isinstance(call.get('args') or {}, dict) or \
+                    not isinstance(call.get('body'), (dict, list, type(None))):
+                raise APIError('Invalid call args or body: %s %s' % (method, path))
+
+            args = url_decode(query_string)
+            args.update(call.get('args') or {})
+
+            endpoint, kwargs = adapter.match(path, method)
+            view = current_app.view_functions.get(endpoint)
+            Resource_ = getattr(view, 'view_class', None)
+            if not endpoint.startswith(self.name + '.') or Resource_ is None or \
+                    Resource_ is self.batch_resource or Resource_ in self.specs_resources:
+                raise APIError('Unsupported call: %s %s' % (method, path), 404)
+
+            body = run(Resource_, method, path, args, call.get('body'), kwargs)
+            status, headers = 200, dict(run.response_headers)
+            if isinstance(body, Response):
+                status, headers = body.status_code, dict(body.headers)
+                body = json.loads(body.get_data(as_text=True)) if body.is_json else \
+                    body.get_data(as_text=True)
+
+        except APIError as exc:
+            status, body = exc.status_code, exc.to_dict()
+
+        except HTTPException as exc:
+            status, body = exc.code, {'error': exc.description, 'code': exc.code}
+
+        # Fail the call only, not the whole batch
+        except Exception:
+            logger.exception('Batch call failed: %s %s', method, path)
+            status, body = 500, {'error': 'Internal server error', 'code': 500}
+
+        return {'status': status, 'headers': headers, 'body': body}
+
     def specs_view(self, *args, **kwargs):
+        mimetypes = list(self.serializers)
+
+        # Formats without `loads` (CSV) are only for responses
+        consumes = [mimetype for mimetype, serializer in self.serializers.items()
+                    if type(serializer).loads != Serializer.loads]
         specs = APISpec(title=self.name, version=self.version,
-                        basePath=self.url_prefix, host=request.host, plugins=[MarshmallowPlugin()])
+                        basePath=self.url_prefix, host=request.host, plugins=[MarshmallowPlugin()],
+                        consumes=consumes, produces=mimetypes)
 
         for resource in self.resources:
             resource.update_specs(specs)
@@ -165,6 +381,11 @@ def url_flask_to_swagger(source):
     return source.replace('<', '{').replace('>', '}')
 
 
+def unlimited(resource, *args, **kwargs):
+    """Skip concurrency limits (the batched calls are limited themselves)."""
+    return resource.process_request(*args, **kwargs)
+
+
 @staticmethod
 def anonimous(*args, **kwargs):
     return True
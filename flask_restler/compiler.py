@@ -0,0 +1,157 @@
+"""Compile marshmallow schemas into specialized dump functions."""
+
+from __future__ import absolute_import
+
+from collections import OrderedDict
+
+import marshmallow as ma
+from flask._compat import text_type
+from marshmallow.utils import missing
+
+from . import logger
+from .fields import Timestamp, MSTimestamp, datetime_to_timestamp
+
+
+# Inline serializers: field class -> (expression, omit None values)
+# The expression gets the value as `{value}` and the field as `{field}`
+INLINE = {}
+
+
+def register(field_cls, expression, omit_none=False):
+    """Register an inline serializer for the given field class (subclasses are not matched)."""
+    INLINE[field_cls] = expression, omit_none
+
+
+register(ma.fields.Raw, '{value}')
+register(ma.fields.String, (
+    '{value} if {value} is None or type({value}) is text_type '
+    'else {field}._serialize({value}, {attr!r}, obj)'))
+register(ma.fields.Integer, (
+    '{value} if type({value}) is int else {field}._serialize({value}, {attr!r}, obj)'))
+register(ma.fields.Float, (
+    '{value} if type({value}) is float else {field}._serialize({value}, {attr!r}, obj)'))
+register(ma.fields.Boolean, (
+    '{value} if {value} is True or {value} is False '
+    'else {field}._serialize({value}, {attr!r}, obj)'))
+register(Timestamp, 'None if {value} is None else int(datetime_to_timestamp({value}))')
+register(MSTimestamp, 'None if {value} is None else int(datetime_to_timestamp({value})) * 1e3')
+
+
+def compile_schema(Schema):
+    """Generate a dump function for the given schema class.
+
+    Return None when the schema isn't supported (dump processors, inferred fields and etc).
+    Unsupported fields are serialized by marshmallow.
+    """
+    schema = Schema()
+    if not supports(schema):
+        return None
+
+    names = tuple(schema.fields)
+    getters = {'dict': [], 'attr': [], 'any': []}
+    setters = []
+    for num, name in enumerate(names):
+        field = schema.fields[name]
+        if field.load_only:
+            continue
+
+        attr = field.attribute or name
+        key = (schema.prefix or '') + (field.dump_to or name)
+        value, field_ = 'v%d' % num, 'f[%d]' % num
+        inline = not getattr(field, 'as_string', False) and INLINE.get(type(field))
+
+        if not inline or not field._CHECK_ATTRIBUTE:
+            setters.append('%s = %s.serialize(%r, obj, accessor=get_attribute)' % (
+                value, field_, name))
+            setters.append('if %s is not missing: result[%r] = %s' % (value, key, value))
+            continue
+
+        # Load the value the same way as `marshmallow.utils.get_value` does
+        if '.' in attr or hasattr(dict, attr):
+            getters['dict'].append('%s = get_attribute(%r, obj, missing)' % (value, attr))
+        else:
+            getters['dict'].append('%s = obj.get(%r, missing)' % (value, attr))
+            getters['dict'].append(
+                'if %s is missing: %s = get_attribute(%r, obj, missing)' % (value, value, attr))
+
+        if '.' in attr:
+            getters['attr'].append('%s = get_attribute(%r, obj, missing)' % (value, attr))
+        else:
+            getters['attr'].append('%s = getattr(obj, %r, missing)' % (value, attr))
+            getters['attr'].append('if callable(%s): %s = %s()' % (value, value, value))
+
+        getters['any'].append('%s = get_attribute(%r, obj, missing)' % (value, attr))
+
+        expression, omit_none = inline
+        expression = expression.format(value=value, field=field_, attr=name)
+        if field.default is missing:
+            condition = omit_none and ' and %s is not None' % value or ''
+            setters.append('if %s is not missing%s: result[%r] = %s' % (
+                value, condition, key, expression))
+        else:
+            setters.append('if %s is missing:' % value)
+            setters.append('    %s = default(%s)' % (value, field_))
+            setters.append('    if %s is not missing: result[%r] = %s' % (value, key, value))
+            condition = omit_none and 'elif %s is not None' % value or 'else'
+            setters.append('%s: result[%r] = %s' % (condition, key, expression))
+
+    lines = ['def dump(obj, f, get_attribute):', '    t = type(obj)']
+    for condition, mode in (
+            ('if t is dict', 'dict'), ("elif not hasattr(t, '__getitem__')", 'attr'),
+            ('else', 'any')):
+        lines.append('    %s:' % condition)
+        lines.extend('        ' + line for line in getters[mode] or ['pass'])
+
+    lines.append('    result = %s' % ('OrderedDict()' if schema.opts.ordered else '{}'))
+    lines.extend('    ' + line for line in setters)
+    lines.append('    return result')
+
+    code = '\n'.join(lines)
+    namespace = dict(
+        missing=missing, text_type=text_type, OrderedDict=OrderedDict, default=default,
+        datetime_to_timestamp=datetime_to_timestamp)
+    exec(compile(code, '<%s dump>' % Schema.__name__, 'exec'), namespace)  # noqa
+    logger.debug('Compiled %s:\n%s', Schema.__name__, code)
+    return Dumper(namespace['dump'], names)
+
+
+def default(field):
+    """Get the field's default value."""
+    return field.default() if callable(field.default) else field.default
+
+
+def supports(schema):
+    """Check that the schema could be compiled."""
+    processors = getattr(schema, '__processors__', {})
+    return not (
+        any(tag in ('pre_dump', 'post_dump') for tag, _ in processors) or
+        schema.opts.fields or schema.opts.additional or schema.extra or
+        type(schema).get_attribute != ma.Schema.get_attribute)
+
+
+class Dumper(object):
+
+    """Dump data with a compiled function, fall back to marshmallow on errors."""
+
+    def __init__(self, func, names):
+        self.func = func
+        self.names = names
+
+    def __call__(self, schema, data, many=False):
+        """Dump the data as `schema.dump(data, many=many).data` does."""
+        if tuple(schema.fields) != self.names or schema.extra:
+            return schema.dump(data, many=many).data
+
+        if many and data is not None and not isinstance(data, (list, tuple)):
+            data = list(data)
+
+        fields = schema.fields
+        fields = [fields[name] for name in self.names]
+        try:
+            if many:
+                return [self.func(obj, fields, schema.get_attribute) for obj in data]
+            return self.func(data, fields, schema.get_attribute)
+
+        except Exception as exc:
+            logger.debug('Compiled dump failed (%r), use marshmallow', exc)
+            return schema.dump(data, many=many).data
@@ -0,0 +1,49 @@
+"""Support response compression."""
+
+from __future__ import absolute_import
+
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def negotiate(accept_encodings):
+    """Choose the best supported encoding."""
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def compress(data, encoding, level=6):
+    """Compress the given bytes."""
+    if encoding == 'br':
+        return brotli.compress(data, quality=level)
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding, level=6):
+    """Compress the given chunks, flush the compressor after each chunk."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            yield compressor.process(encode(chunk)) + compressor.flush()
+        yield compressor.finish()
+        return
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        yield compressor.compress(encode(chunk)) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    yield compressor.flush()
+
+
+def encode(chunk):
+    """Ensure the chunk is bytes."""
+    if isinstance(chunk, bytes):
+        return chunk
+    return chunk.encode('utf-8')
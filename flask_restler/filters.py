@@ -5,6 +5,7 @@ import operator
 
 from cached_property import cached_property
 from flask import request
+from flask._compat import string_types
 from marshmallow import fields, missing, ValidationError
 from . import logger
 
@@ -46,14 +47,17 @@ class Filter(object):
             return (self.operators['$eq'], val),
 
         ops = ()
-        request.filters[self.fname] = {}
+        parsed = {}
         for op, val in val.items():
             if op not in self.operators:
                 continue
             val = self.field.deserialize(val) if op not in self.list_ops else [self.field.deserialize(v) for v in val]  # noqa
             ops += (self.operators[op], val),
-            request.filters[self.fname][op] = val
+            parsed[op] = val
 
+        # Only valid operators are stored (bulk operations rely on it)
+        if parsed:
+            request.filters[self.fname] = parsed
         return ops
 
     def filter(self, collection, data, **kwargs):
@@ -63,6 +67,11 @@ class Filter(object):
         except ValidationError:
             return collection
 
+    def skip(self, collection):
+        """Mark the filter as not applied and return the collection as is."""
+        request.filters.pop(self.fname, None)
+        return collection
+
     def apply(self, collection, ops, **kwargs):  # noqa
         """Apply current filter."""
         def validator(obj):
@@ -101,10 +110,11 @@ class Filters(object):
         if not data or self.filters is None:
             return collection
 
-        try:
-            data = json.loads(data)
-        except (ValueError, TypeError):
-            return collection
+        if isinstance(data, string_types):
+            try:
+                data = json.loads(data)
+            except (ValueError, TypeError):
+                return collection
 
         logger.debug('Filter resources: %r', data)
 
@@ -113,3 +123,8 @@ class Filters(object):
         for f in filters:
             collection = f.filter(collection, data, view=view, **kwargs)
         return collection
+
+
+def fts_query(value):
+    """Convert user input to a safe SQLite FTS query (all the terms should match)."""
+    return ' '.join('"%s"' % term.replace('"', '""') for term in value.split())
@@ -0,0 +1,69 @@
+"""Check that filters and sortings are backed by indexes."""
+
+from __future__ import absolute_import
+
+
+def check_indexes(Resource):
+    """Find filters and sortings of the given resource which can't use indexes.
+
+    Return a list of dicts with `resource`, `filter`, `sort`, `table` and `message`.
+    Resources which don't know their indexes (`Resource.get_indexes` returns None) are skipped.
+    """
+    meta = Resource.meta
+    indexes = {}
+
+    def get_indexes(table):
+        if table not in indexes:
+            indexes[table] = Resource.get_indexes(table)
+        return indexes[table]
+
+    filters = [(flt.name, Resource.get_column(flt)) for flt in meta.filters.filters or ()]
+    sortings = [(name, Resource.get_column(prop)) for name, prop in sorted(meta.sorting.items())]
+    filters = [(name, column) for name, column in filters if column is not None]
+    sortings = [(name, column) for name, column in sortings if column is not None]
+
+    report = []
+
+    def scan(table, message, filter=None, sort=None):
+        report.append({
+            'resource': meta.name, 'filter': filter, 'sort': sort, 'table': table,
+            'message': '%s: %s' % (meta.name, message)})
+
+    for (name, (table, column)) in filters:
+        idx = get_indexes(table)
+        if idx is not None and not leads(idx, column):
+            scan(table, "filter '%s' scans table '%s' (no index on %s)" % (
+                name, table, column), filter=name)
+
+    for (name, (table, column)) in sortings:
+        idx = get_indexes(table)
+        if idx is not None and not leads(idx, column):
+            scan(table, "sorting '%s' sorts table '%s' in memory (no index on %s)" % (
+                name, table, column), sort=name)
+
+    # Filter by an indexed column and sort by another one
+    for (fname, (ftable, fcolumn)) in filters:
+        idx = get_indexes(ftable)
+        if idx is None or not leads(idx, fcolumn) or unique(idx, fcolumn):
+            continue
+
+        for (sname, (stable, scolumn)) in sortings:
+            if stable != ftable or scolumn == fcolumn or not leads(idx, scolumn):
+                continue
+
+            if not any(columns[:2] == (fcolumn, scolumn) for columns, _ in idx):
+                scan(ftable, "filter '%s' with sorting '%s' sorts in memory "
+                     "(no index on %s, %s)" % (fname, sname, fcolumn, scolumn),
+                     filter=fname, sort=sname)
+
+    return report
+
+
+def leads(indexes, column):
+    """Check that any of the indexes starts with the column."""
+    return any(columns[0] == column for columns, _ in indexes)
+
+
+def unique(indexes, column):
+    """Check that the column is unique."""
+    return any(columns == (column,) and is_unique for columns, is_unique in indexes)
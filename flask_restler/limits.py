@@ -0,0 +1,146 @@
+"""Limit concurrent requests."""
+
+from __future__ import absolute_import
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, Response
+
+from . import APIError, logger
+
+
+class Limit(object):
+
+    """Limit concurrent requests with a counter of free slots.
+
+    Requests wait for a free slot at most `timeout` seconds, then they are rejected with 503.
+    """
+
+    def __init__(self, concurrency, timeout=0.1, retry_after=1):
+        """Initialize the limit."""
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.free = concurrency
+        self.lock = threading.Lock()
+        self.condition = threading.Condition(self.lock)
+        self.stats = dict(active=0, waiting=0, accepted=0, rejected=0, wait_time=0.0)
+
+    def __repr__(self):
+        return '<Limit %d %r>' % (self.concurrency, self.stats)
+
+    def acquire(self):
+        """Wait for a free slot."""
+        start = time.time()
+        with self.condition:
+            self.stats['waiting'] += 1
+
+            # Python 2 semaphores don't support timeouts
+            while not self.free:
+                remaining = start + self.timeout - time.time()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            acquired = self.free > 0
+            self.stats['waiting'] -= 1
+            self.stats['wait_time'] += time.time() - start
+            if acquired:
+                self.free -= 1
+                self.stats['active'] += 1
+                self.stats['accepted'] += 1
+            else:
+                self.stats['rejected'] += 1
+
+        if not acquired:
+            logger.warning('Request rejected: %r', self)
+            raise APIError('Service unavailable', status_code=503,
+                           headers={'Retry-After': str(self.retry_after)})
+
+    def release(self):
+        """Release the slot."""
+        with self.condition:
+            self.free += 1
+            self.stats['active'] -= 1
+            self.condition.notify()
+
+
+class Flight(object):
+
+    """A request in progress."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class Coalesce(object):
+
+    """Share encoded responses between identical concurrent requests (single-flight).
+
+    Followers wait for the leader at most `timeout` seconds, then they process the request
+    independently.
+    """
+
+    def __init__(self, timeout=5):
+        """Initialize the coalescing."""
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.stats = dict(leaders=0, followers=0, timeouts=0)
+
+    def run(self, key, func, *args, **kwargs):
+        """Run the function or wait for the same one in progress."""
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.stats['leaders'] += 1
+
+        if not leader:
+            if flight.event.wait(self.timeout) and flight.result is not None:
+                self.stats['followers'] += 1
+                data, status, headers = flight.result
+                return current_app.response_class(data, status=status, headers=headers)
+
+            self.stats['timeouts'] += 1
+            return func(*args, **kwargs)
+
+        try:
+            response = func(*args, **kwargs)
+            if isinstance(response, Response) and not response.is_streamed:
+                flight.result = response.get_data(), response.status_code, list(response.headers)
+            return response
+
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+
+
+@contextmanager
+def acquire(*limits):
+    """Acquire the given limits (skip empty ones).
+
+    Yield the acquired limits. A caller could take them over (move them out of the list)
+    and release them later with `release`.
+    """
+    acquired = []
+    try:
+        for limit in limits:
+            if limit is not None:
+                limit.acquire()
+                acquired.append(limit)
+        yield acquired
+
+    finally:
+        release(acquired)
+
+
+def release(limits):
+    """Release the given limits."""
+    for limit in reversed(limits):
+        limit.release()
@@ -1,12 +1,24 @@
 """Support Mongo DB."""
+import datetime as dt
+from inspect import isclass
 from types import FunctionType
 
 import bson
+from bson.son import SON
 import marshmallow as ma
+from cached_property import cached_property
+from flask import request, json, current_app
 from flask._compat import string_types
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
 
+from . import compiler
 from .filters import Filter as VanilaFilter, Filters
-from .resource import ResourceOptions, Resource, APIError, logger
+from .resource import ResourceOptions, Resource, APIError, logger, SAFE_METHODS
+from .serializers import JSON, default
+
+
+EMBED_ARG = 'embed'
+EMBED_PREFIX = '__embed_'
 
 
 class ObjectId(ma.fields.Field):
@@ -25,6 +37,9 @@ class ObjectId(ma.fields.Field):
         return str(value)
 
 
+compiler.register(ObjectId, 'str({value})', omit_none=True)
+
+
 class MongoSchema(ma.Schema):
 
     """Serialize/deserialize results from mongo."""
@@ -60,16 +75,36 @@ class MongoOptions(ResourceOptions):
         self._collection = None
         super(MongoOptions, self).__init__(cls)
         self.name = self.meta and getattr(self.meta, 'name', None)
+
+        self.embed = {
+            name: embed_options(value) for name, value in (self.embed or {}).items()}
+        if self.embed and self.strict:
+            self.strict.add(EMBED_ARG)
+
         if not self.collection:
             return
 
         self.name = self.name or str(self.collection.name)
 
+        if isinstance(self.read_preference, dict):
+            self.read_preference = {
+                method.upper(): read_preference(value)
+                for method, value in self.read_preference.items()}
+        else:
+            self.read_preference = read_preference(self.read_preference)
+
         if not cls.Schema:
             meta = type('Meta', (object,), self.schema_meta)
             cls.Schema = type(
                 self.name.title() + 'Schema', (MongoSchema,), dict({'Meta': meta}, **self.schema))
 
+        # Passthrough (attribute, key) pairs, keys are the dumped names
+        if self.passthrough:
+            schema = cls.Schema()
+            self.passthrough = tuple(
+                (field.attribute or name, getattr(field, 'dump_to', None) or name)
+                for name, field in schema.fields.items() if not field.load_only)
+
     @property
     def collection(self):
         """Support lambdas as collection."""
@@ -134,17 +169,21 @@ class MongoChain(object):
         'alive', 'address', 'add_option', '__getitem__'
     )
 
-    def __init__(self, collection):
+    def __init__(self, collection, read_preference=None, max_time_ms=None, batch_size=None):
         """Initialize the resource."""
+        if read_preference is not None:
+            collection = collection.with_options(read_preference=read_preference)
         self.collection = collection
         self.query = []
         self.projection = None
         self.sorting = None
+        self.cursor_options = dict(max_time_ms=max_time_ms, batch_size=batch_size)
 
     def find(self, query=None, projection=None):
         """Store filters in self."""
         self.query = self.__update__(query)
-        self.projection = projection
+        if projection is not None:
+            self.projection = projection
         return self
 
     def find_one(self, query=None, projection=None):
@@ -152,10 +191,16 @@ class MongoChain(object):
         query = self.__update__(query)
         query = query and {'$and': query} or {}
         logger.debug('Mongo find one: %r', query)
+        if self.cursor_options['max_time_ms']:
+            return self.collection.find_one(
+                query, projection=projection, max_time_ms=self.cursor_options['max_time_ms'])
         return self.collection.find_one(query, projection=projection)
 
-    def aggregate(self, pipeline, **kwargs):
-        """Aggregate collection."""
+    def aggregate(self, pipeline, lookups=None, **kwargs):
+        """Aggregate collection.
+
+        :param lookups: `$lookup` stages to join after filtering, sorting and pagination
+        """
         if self.query:
             for params in pipeline:
                 if '$match' in params:
@@ -163,12 +208,22 @@ class MongoChain(object):
                     params['$match'] = {'$and': query}
                     break
             else:
-                pipeline.insert(0, {'$match': {'$and': query}})
+                pipeline.insert(0, {'$match': {'$and': self.query}})
             logger.debug('Mongo aggregate: %r', pipeline)
 
         if self.sorting:
             pipeline = [p for p in pipeline if '$sort' not in p]
-            pipeline.append({'$sort': dict(self.sorting)})
+            index = next((num for num, p in enumerate(pipeline) if '$skip' in p or '$limit' in p),
+                         len(pipeline))
+            pipeline.insert(index, {'$sort': dict(self.sorting)})
+
+        if lookups:
+            pipeline = pipeline + list(lookups)
+
+        if self.cursor_options['max_time_ms']:
+            kwargs.setdefault('maxTimeMS', self.cursor_options['max_time_ms'])
+        if self.cursor_options['batch_size']:
+            kwargs.setdefault('batchSize', self.cursor_options['batch_size'])
 
         return self.collection.aggregate(pipeline, **kwargs)
 
@@ -192,26 +247,78 @@ class MongoChain(object):
 
         return self.query
 
-    def __iter__(self):
-        """Iterate by self collection."""
+    def __cursor__(self):
+        """Create a cursor."""
         query = self.query and {'$and': self.query} or {}
+        cursor = self.collection.find(query, self.projection)
         if self.sorting:
-            return self.collection.find(query, self.projection).sort(self.sorting)
+            cursor = cursor.sort(self.sorting)
 
-        return self.collection.find(query, self.projection)
+        for name, value in self.cursor_options.items():
+            if value:
+                cursor = getattr(cursor, name)(value)
+
+        return cursor
+
+    def __iter__(self):
+        """Iterate by self collection."""
+        return self.__cursor__()
 
     def __getattr__(self, name):
         """Proxy any attributes except find to self.collection."""
         logger.debug('Mongo load: %r', self.query)
         if name in self.CURSOR_METHODS:
-            query = self.query and {'$and': self.query} or {}
-            cursor = self.collection.find(query, self.projection)
-            if self.sorting:
-                cursor = cursor.sort(self.sorting)
-            return getattr(cursor, name)
+            return getattr(self.__cursor__(), name)
         return getattr(self.collection, name)
 
 
+def read_preference(value):
+    """Convert read preference names (secondaryPreferred) to pymongo read preferences."""
+    if isinstance(value, string_types):
+        return make_read_preference(read_pref_mode_from_name(value), None)
+    return value
+
+
+def passthrough_default(obj):
+    """Convert BSON types for passthrough JSON."""
+    if isinstance(obj, bson.ObjectId):
+        return str(obj)
+    if isinstance(obj, dt.datetime):
+        return obj.isoformat()
+    return default(obj)
+
+
+def embed_options(value):
+    """Normalize embedded documents options."""
+    if not isinstance(value, dict):
+        value = {'collection': value}
+
+    options = dict({'key': '_id', 'schema': None}, **value)
+    if isclass(options['schema']):
+        options['schema'] = options['schema']()
+    return options
+
+
+def references(value):
+    """Iterate by referenced ids (a single id or a list)."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return value
+    return [value]
+
+
+def simplify(value):
+    """Convert ObjectIds in the given document to strings."""
+    if isinstance(value, bson.ObjectId):
+        return str(value)
+    if isinstance(value, dict):
+        return {key: simplify(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [simplify(item) for item in value]
+    return value
+
+
 class MongoResource(Resource):
 
     """Provide API for Pymongo document and collections."""
@@ -229,9 +336,44 @@ class MongoResource(Resource):
         object_id = '_id'
         schema = {}
 
+        # Read preference (a name or pymongo.ReadPreference), could be set per method:
+        #   read_preference = {'GET': 'secondaryPreferred'}
+        read_preference = None
+
+        # Limit time of list queries
+        max_time_ms = None
+
+        # Full-text search with `$text` (the collection should have a text index).
+        # Results are sorted by `textScore` unless `sort` param is given.
+        search = False
+
+        # Embed referenced documents by `embed=author,tags` query param:
+        #   embed = {'author': db.user}
+        #   embed = {'tags': {'collection': db.tag, 'key': '_id', 'schema': TagSchema}}
+        # Referenced ids are loaded with one `$in` query per collection
+        embed = {}
+
+        # Join embedded documents with `$lookup` in list queries instead of `$in` queries
+        # (the collections should be in the same database)
+        embed_lookup = False
+
+        # Encode documents for GET requests straight to JSON and skip the schema dump.
+        # Documents are only projected to the schema fields (ObjectId -> str,
+        # datetime -> ISO 8601). Enable it only when the documents are safe to expose as is.
+        passthrough = False
+
     def get_many(self, *args, **kwargs):
         """Return collection filters."""
-        return MongoChain(self.meta.collection)
+        read_preference = self.meta.read_preference
+        if isinstance(read_preference, dict):
+            read_preference = read_preference.get(request.method)
+
+        collection = MongoChain(
+            self.meta.collection, read_preference=read_preference,
+            max_time_ms=self.meta.max_time_ms, batch_size=self.meta.batch_size)
+        if self.meta.passthrough:
+            collection.find(projection={attr: 1 for attr, _ in self.meta.passthrough})
+        return collection
 
     def get_one(self, *args, **kwargs):
         """Load a resource."""
@@ -243,21 +385,155 @@ class MongoResource(Resource):
 
     def paginate(self, offset=0, limit=None):
         """Paginate collection."""
-        if self.meta.aggregate:
-            pipeline_all = self.meta.aggregate + [{'$skip': offset}, {'$limit': limit}]
-            pipeline_num = self.meta.aggregate + [{'$group': {'_id': None, 'total': {'$sum': 1}}}]
+        lookups = self.get_lookups()
+        if self.meta.aggregate or lookups:
+            pipeline = list(self.meta.aggregate or [])
+            pipeline_all = pipeline + [{'$skip': offset}, {'$limit': limit}]
+            pipeline_num = pipeline + [{'$group': {'_id': None, 'total': {'$sum': 1}}}]
             counts = list(self.collection.aggregate(pipeline_num))
             return (
-                self.collection.aggregate(pipeline_all),
+                self.collection.aggregate(pipeline_all, lookups=lookups),
                 counts and counts[0]['total'] or 0
             )
         return self.collection.skip(offset).limit(limit), self.collection.count()
 
+    @classmethod
+    def get_indexes(cls, table):
+        """Load indexes from the collection."""
+        collection = cls.meta.collection
+        if collection is None:
+            return None
+        indexes = [(tuple(key for key, _ in index['key']), bool(index.get('unique')))
+                   for index in collection.index_information().values()]
+        return [(columns, unique or columns == ('_id',)) for columns, unique in indexes]
+
+    @classmethod
+    def get_column(cls, field):
+        """Get (collection, field) for the given filter or sorting."""
+        if cls.meta.collection is None or cls.meta.aggregate:
+            return None
+        if isinstance(field, VanilaFilter):
+            field = field.name
+        return cls.meta.collection.name, field
+
+    def stream(self, collection):
+        """Iterate the collection by batches."""
+        if self.meta.aggregate:
+            return collection.aggregate(list(self.meta.aggregate), batchSize=self.meta.batch_size)
+        return collection.batch_size(self.meta.batch_size)
+
     def to_simple(self, data, many=False, **kwargs):
-        """Support aggregation."""
-        if isinstance(data, MongoChain) and self.meta.aggregate:
-            data = data.aggregate(self.meta.aggregate)
-        return super(MongoResource, self).to_simple(data, many=many, **kwargs)
+        """Support aggregation, embedded documents and passthrough."""
+        lookups = self.get_lookups()
+        if isinstance(data, MongoChain) and (self.meta.aggregate or lookups):
+            data = data.aggregate(list(self.meta.aggregate or []), lookups=lookups)
+
+        names = self.get_embed()
+        if self.meta.passthrough and not names and request.method in SAFE_METHODS:
+            return self.passthrough(data, many=many)
+
+        if not names:
+            return super(MongoResource, self).to_simple(data, many=many, **kwargs)
+
+        docs = list(data) if many else [data]
+        embedded = self.load_embedded(docs, names)
+        result = super(MongoResource, self).to_simple(docs if many else data, many=many, **kwargs)
+        for row, values in zip(result if many else [result], embedded):
+            row.update(values)
+        return result
+
+    def passthrough(self, data, many=False):
+        """Encode the documents to JSON without the schema."""
+        names = self.meta.passthrough
+        docs = [{key: doc[attr] for attr, key in names if attr in doc} for doc in (
+            data if many else [data])]
+        if self.raw or self.get_serializer() is not JSON:
+            return simplify(docs if many else docs[0])
+
+        return current_app.response_class(
+            json.dumps(docs if many else docs[0], default=passthrough_default),
+            mimetype=JSON.mimetype)
+
+    def get_embed(self):
+        """Get names of requested embedded documents."""
+        value = request.args.get(EMBED_ARG)
+        if not value or not self.meta.embed:
+            return []
+
+        names = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in names if name not in self.meta.embed]
+        if unknown:
+            raise APIError('Unsupported embedded documents: %s' % ', '.join(unknown))
+        return names
+
+    def get_lookups(self):
+        """Build `$lookup` stages for requested embedded documents."""
+        if not self.meta.embed_lookup:
+            return []
+
+        lookups = []
+        for name in self.get_embed():
+            options = self.meta.embed[name]
+            collection = options['collection']
+            if isinstance(collection, FunctionType):
+                collection = collection()
+            lookups.append({'$lookup': {
+                'from': collection.name, 'localField': name,
+                'foreignField': options['key'], 'as': EMBED_PREFIX + name}})
+        return lookups
+
+    @cached_property
+    def embedded(self):
+        """Cache embedded documents for the current request."""
+        return {}
+
+    def load_embedded(self, docs, names):
+        """Load referenced documents for the given documents.
+
+        Ids are deduplicated and loaded with one `$in` query per collection. Loaded documents
+        are cached for the current request.
+        """
+        cache = self.embedded
+        rows = [{} for _ in docs]
+        for name in names:
+            options = self.meta.embed[name]
+            key, schema = options['key'], options['schema']
+
+            # Documents joined with $lookup
+            joined = EMBED_PREFIX + name
+            lookup = False
+            for doc in docs:
+                if joined in doc:
+                    lookup = True
+                    for item in doc.pop(joined) or ():
+                        cache[name, item[key]] = item
+
+            refs = set(ref for doc in docs for ref in references(doc.get(name)))
+            missing = [ref for ref in refs if (name, ref) not in cache]
+            if missing and not lookup:
+                collection = options['collection']
+                if isinstance(collection, FunctionType):
+                    collection = collection()
+
+                logger.debug('Mongo embed %s: %r', name, missing)
+                cache.update(((name, ref), None) for ref in missing)
+                for item in collection.find({key: {'$in': missing}}):
+                    cache[name, item[key]] = item
+
+            def dump(ref):
+                item = cache.get((name, ref))
+                if item is None:
+                    return None
+                return schema.dump(item).data if schema else simplify(item)
+
+            for doc, row in zip(docs, rows):
+                value = doc.get(name)
+                if isinstance(value, (list, tuple)):
+                    row[name] = [dump(ref) for ref in value]
+                else:
+                    row[name] = dump(value) if value is not None else None
+
+        return rows
 
     def get_schema(self, resource=None, **kwargs):
         """Create the resource schema."""
@@ -272,6 +548,55 @@ class MongoResource(Resource):
             resource['_id'] = write.inserted_id
         return resource
 
+    def bulk_count(self, collection):
+        return collection.count()
+
+    def bulk_delete(self, collection):
+        """Delete the resources with `delete_many`."""
+        return self.meta.collection.delete_many({'$and': collection.query}).deleted_count
+
+    def bulk_update(self, collection, values):
+        """Update the resources with `update_many`."""
+        return self.meta.collection.update_many(
+            {'$and': collection.query}, {'$set': values}).matched_count
+
+    def group(self, collection, groups, aggregates):
+        """Aggregate the collection with a `$group` stage."""
+        group = {'_id': {name: '$' + prop for name, prop in groups} or None}
+        for label, name, prop in aggregates:
+            group[label] = {'$sum': 1} if name == 'count' else {'$' + name: '$' + prop}
+
+        collection.sorting = None
+        pipeline = list(self.meta.aggregate or []) + [{'$group': group}]
+        if groups:
+            pipeline.append({'$sort': SON(('_id.' + name, 1) for name, _ in groups)})
+
+        rows = []
+        for row in collection.aggregate(pipeline):
+            rows.append(dict(row.pop('_id') or {}, **row))
+        return rows
+
+    def search(self, collection, query, *args, **kwargs):
+        """Search with the collection's text index."""
+        score = {'$meta': 'textScore'}
+        collection = collection.find(
+            {'$text': {'$search': query}}, dict(collection.projection or {}, score=score))
+        return collection.sort([('score', score)])
+
+    def changed_since(self, collection, since, *args, **kwargs):
+        """Filter resources changed at the given time or later."""
+        return collection.find({self.meta.updated_field: {'$gte': since}})
+
+    def get_tombstone(self, resource):
+        """Identify the deleted resource by its object id."""
+        return {self.meta.object_id: str(resource[self.meta.object_id])}
+
+    def get_tombstones(self, collection):
+        """Load only object ids of the resources deleted in bulk."""
+        object_id = self.meta.object_id
+        return [{object_id: str(doc[object_id])} for doc in self.meta.collection.find(
+            {'$and': collection.query}, {object_id: 1})]
+
     def sort(self, collection, *sorting, **Kwargs):
         """Sort resources."""
         sorting = {name: -1 if desc else 1 for name, desc in sorting}
@@ -1,10 +1,22 @@
 """Support Peewee ORM."""
 from __future__ import absolute_import
-from peewee import SQL, Field
+import copy
+import operator
+import time
+from functools import reduce
+
+import marshmallow as ma
+from cached_property import cached_property
+from peewee import SQL, Expression, Field, ForeignKeyField, Proxy, SelectQuery, fn
+from playhouse.pool import PooledDatabase, MaxConnectionsExceeded
+from flask import request, current_app
 from flask._compat import string_types
 
-from .resource import ResourceOptions, Resource, APIError, logger
-from .filters import Filter as VanilaFilter, Filters
+from .compiler import compile_schema
+from .resource import (
+    ResourceOptions, Resource, APIError, logger, Replicas, SAFE_METHODS, SORT_ARG,
+    prefers_minimal)
+from .filters import Filter as VanilaFilter, Filters, fts_query
 
 try:
     from marshmallow_peewee import ModelSchema
@@ -14,6 +26,9 @@ except ImportError:
     raise
 
 
+POOL_WAIT_STEP = 0.05
+
+
 def ensure_join(qs, lm, rm, on=None, **join_kwargs):
     """TODO: remove me when problem in Peewee will be fixed."""
     ctx = qs._query_ctx
@@ -51,7 +66,7 @@ class Filter(VanilaFilter):
     def apply(self, collection, ops, view=None, **kwargs):
         """Filter given Peewee collection."""
         if not self.mfield and view is None:
-            return collection
+            return self.skip(collection)
 
         logger.debug('Apply filter %s (%r)', self.name, ops)
 
@@ -61,6 +76,8 @@ class Filter(VanilaFilter):
             collection = ensure_join(collection, view.meta.model, self.mfield.model_class)
 
         mfield = self.mfield or view.meta.model._meta.fields.get(self.field.attribute)
+        if mfield is None:
+            return self.skip(collection)
         return collection.where(*[op(mfield, val) for op, val in ops])
 
 
@@ -84,13 +101,20 @@ class ModelResourceOptions(ResourceOptions):
         self.sorting = dict(
             (isinstance(n, Field) and n.name or n, prop)
             for (n, prop) in self.sorting.items())
+        self.aggregations = dict(
+            (isinstance(n, Field) and n.name or n, prop)
+            for (n, prop) in self.aggregations.items())
 
+        self.row_schema = self.row_columns = self.row_dumper = None
         if not self.model:
             return None
 
         if not self.primary_key:
             self.primary_key = self.model._meta.get_primary_keys()[0]
 
+        if self.read_database and not isinstance(self.read_database, Replicas):
+            self.read_database = Replicas(self.read_database, self.read_your_writes)
+
         if not cls.Schema:
             meta = type('Meta', (object,), dict({'model': self.model}, **self.schema_meta))
             if self.models_converter:
@@ -99,6 +123,15 @@ class ModelResourceOptions(ResourceOptions):
             cls.Schema = type(
                 self.name.title() + 'Schema', (ModelSchema,), dict({'Meta': meta}, **self.schema))
 
+        if self.read_mode == 'rows':
+            self.row_schema, self.row_columns = make_row_schema(cls.Schema, self.model)
+            if self.row_schema is None:
+                logger.warning('%s: Schema has fields which are not columns, use model reads.', cls)
+                self.read_mode = 'models'
+
+            elif self.compile_schema:
+                self.row_dumper = compile_schema(self.row_schema)
+
 
 class ModelResource(Resource):
 
@@ -116,9 +149,118 @@ class ModelResource(Resource):
         primary_key = None
         schema = {}
 
+        # Databases for GET/HEAD requests (a database, a lambda or a list for round-robin)
+        read_database = None
+
+        # Seconds to read from the primary database after the client's write
+        read_your_writes = 0
+
+        # Seconds to wait for a pooled connection (None: connect lazily with the pool's timeout)
+        pool_timeout = None
+
+        # Read mode for collections: 'models' (load model instances) or 'rows' (select only
+        # the serialized columns as dicts and dump them without model instances)
+        read_mode = 'models'
+
+        # Full-text search: an FTS model (playhouse.sqlite_ext) which rowids are the model's
+        # primary keys, or Postgres tsvector fields (matched with plainto_tsquery)
+        search = None
+
+        # PATCH with a single UPDATE statement without loading the resource
+        # (`post_load` hooks of the schema are skipped)
+        # (skip the response body with `Prefer: return=minimal` header)
+        fast_patch = False
+
+    @cached_property
+    def database(self):
+        """Get the database once per request. Use read replicas for safe requests."""
+        replicas = self.meta.read_database
+        if replicas and request.method in SAFE_METHODS and \
+                replicas.is_available(request.remote_addr):
+            return replicas.get()
+
+        database = self.meta.model._meta.database
+        if isinstance(database, Proxy):
+            database = database.obj
+        return database
+
+    def process_request(self, *args, **kwargs):
+        """Return pooled connections at the end of the request."""
+        database = self.database
+        pooled = isinstance(database, PooledDatabase)
+        try:
+            if pooled and self.meta.pool_timeout is not None:
+                connect(database, self.meta.pool_timeout)
+
+            response = super(ModelResource, self).process_request(*args, **kwargs)
+
+        except MaxConnectionsExceeded:
+            raise APIError('Service unavailable', status_code=503)
+
+        finally:
+            if pooled:
+                release(database)
+
+        if pooled and getattr(response, 'is_streamed', False):
+            response.call_on_close(lambda: release(database))
+
+        if self.meta.read_database and request.method not in SAFE_METHODS:
+            self.meta.read_database.wrote(request.remote_addr)
+
+        return response
+
     def get_many(self, *args, **kwargs):
         """Setup queryset."""
-        return self.meta.model.select()
+        return self.meta.model.select().bind(self.database)
+
+    def search(self, collection, query, *args, **kwargs):
+        """Search with native full-text indexes."""
+        search = self.meta.search
+        if isinstance(search, type) and hasattr(search, 'rank'):
+            collection = collection.join(
+                search, on=(search.rowid == self.meta.primary_key)).where(
+                    search.match(fts_query(query)))
+            if SORT_ARG in request.args:
+                return collection
+            return collection.order_by(search.rank())
+
+        if isinstance(search, (string_types, Field)):
+            search = search,
+
+        fields = [self.meta.model._meta.fields[f] if isinstance(f, string_types) else f
+                  for f in search]
+        # TSVectorField.match uses to_tsquery which fails on plain user input
+        return collection.where(reduce(operator.or_, [
+            Expression(f, '@@', fn.plainto_tsquery(query)) for f in fields]))
+
+    def changed_since(self, collection, since, *args, **kwargs):
+        """Filter resources changed at the given time or later."""
+        return collection.where(self.meta.model._meta.fields[self.meta.updated_field] >= since)
+
+    def get_tombstone(self, resource):
+        """Identify the deleted resource by its primary key."""
+        return {self.meta.primary_key.name: resource.get_id()}
+
+    def get_tombstones(self, collection):
+        """Select only primary keys of the resources deleted in bulk."""
+        pk = self.meta.primary_key
+        return [{pk.name: row[0]} for row in collection.select(pk).tuples()]
+
+    def group(self, collection, groups, aggregates):
+        """Aggregate the collection with GROUP BY."""
+        fields = self.meta.model._meta.fields
+
+        def field(prop):
+            return fields[prop] if isinstance(prop, string_types) else prop
+
+        columns = [field(prop) for _, prop in groups]
+        selected = [column.alias(name) for column, (name, _) in zip(columns, groups)] + [
+            (fn.COUNT(SQL('*')) if name == 'count' else getattr(fn, name.upper())(field(prop)))
+            .alias(label) for label, name, prop in aggregates]
+        rows = collection.select(*selected).order_by()
+        if columns:
+            rows = rows.group_by(*columns).order_by(*columns)
+        return list(rows.dicts())
 
     def sort(self, collection, *sorting, **Kwargs):
         """Sort resources."""
@@ -141,6 +283,10 @@ class ModelResource(Resource):
         if not resource:
             return None
 
+        # The resource is updated by `patch`
+        if self.meta.fast_patch and request.method == 'PATCH':
+            return resource
+
         try:
             resource = self.collection.where(self.meta.primary_key == resource).get()
         except self.meta.model.DoesNotExist:
@@ -152,17 +298,97 @@ class ModelResource(Resource):
         """Put resource to schema."""
         return self.Schema(instance=resource)
 
+    def to_simple(self, data, many=False, **kwargs):
+        """Dump collections from dicts in the rows read mode."""
+        if many and self.meta.read_mode == 'rows' and isinstance(data, SelectQuery) and \
+                request.method in SAFE_METHODS:
+            rows = list(data.select(*self.meta.row_columns).dicts())
+            schema = self.meta.row_schema()
+            if self.meta.row_dumper is not None:
+                return self.meta.row_dumper(schema, rows, many=True)
+            return schema.dump(rows, many=True).data
+        return super(ModelResource, self).to_simple(data, many=many, **kwargs)
+
     def save(self, resource):
         """Save resource to DB."""
         resource.save()
         return resource
 
+    def patch(self, resource=None, **kwargs):
+        """Update a resource (with a single UPDATE statement when `Meta.fast_patch` is set)."""
+        if not self.meta.fast_patch:
+            return super(ModelResource, self).patch(resource=resource, **kwargs)
+
+        if resource is None:
+            raise APIError('Resource not found', status_code=404)
+
+        values = self.load_values(self.get_data() or {}, **kwargs)
+        query = self.collection.where(self.meta.primary_key == resource)
+        count = self.bulk_update(query, values) if values else query.count()
+
+        if not count:
+            raise APIError('Resource not found', status_code=404)
+
+        if prefers_minimal():
+            return current_app.response_class(status=204)
+
+        return self.to_simple(query.get(), **kwargs)
+
     def delete(self, resource=None, **kwargs):
         """Delete a resource."""
         if resource is None:
             raise APIError('Resource not found', status_code=404)
         resource.delete_instance()
 
+    def bulk_count(self, collection):
+        return collection.count()
+
+    def bulk_delete(self, collection):
+        """Delete the resources with one DELETE statement."""
+        return self.bulk_where(self.meta.model.delete(), collection).execute()
+
+    def bulk_update(self, collection, values):
+        """Update the resources with one UPDATE statement."""
+        return self.bulk_where(self.meta.model.update(**values), collection).execute()
+
+    def bulk_where(self, query, collection):
+        """Apply the collection's conditions to the DELETE/UPDATE query."""
+        pk = self.meta.primary_key
+        if collection._joins:
+            query = query.where(pk.in_(collection.select(pk)))
+        elif collection._where is not None:
+            query = query.where(collection._where)
+        return query.bind(self.database)
+
+    @classmethod
+    def get_indexes(cls, table):
+        """Load indexes (including the primary key) from the database."""
+        database = cls.meta.model._meta.database
+        if isinstance(database, Proxy):
+            database = database.obj
+
+        indexes = [(tuple(database.get_primary_keys(table)), True)]
+        indexes += [(tuple(index.columns), index.unique) for index in database.get_indexes(table)]
+        return [(columns, unique) for columns, unique in indexes if columns]
+
+    @classmethod
+    def get_column(cls, field):
+        """Get (table, column) for the given filter or sorting."""
+        if isinstance(field, VanilaFilter):
+            field = field.mfield or cls.meta.model._meta.fields.get(
+                field.field.attribute or field.name)
+
+        if isinstance(field, string_types):
+            field = cls.meta.model._meta.fields.get(field)
+
+        if not isinstance(field, Field):
+            return None
+        return field.model._meta.table_name, field.column_name
+
+    def stream(self, collection):
+        """Iterate the collection without caching rows."""
+        return collection.iterator()
+
     def paginate(self, offset=0, limit=None):
         """Paginate queryset."""
         logger.debug('Paginate collection, offset: %d, limit: %d', offset, limit)
@@ -172,4 +398,71 @@ class ModelResource(Resource):
 
         return self.collection.offset(offset).limit(limit), qs.count()
 
+
+class RowForeignKey(ma.fields.Raw):
+
+    """Dump foreign keys from rows as `marshmallow_peewee.fields.ForeignKey` does."""
+
+    def _serialize(self, value, attr, obj):
+        return None if value is None else str(value)
+
+
+def make_row_schema(Schema, model):
+    """Build a schema for rows and the columns to select from the given model schema.
+
+    Return (None, None) if the schema has fields which are not columns.
+    """
+    schema = Schema()
+    fields, columns = {}, []
+    for name, field in schema.fields.items():
+        if field.load_only:
+            continue
+
+        column = model._meta.fields.get(field.attribute or name)
+        if column is None or isinstance(field, ma.fields.Nested):
+            return None, None
+
+        if isinstance(column, ForeignKeyField):
+            field = RowForeignKey(dump_to=field.dump_to)
+        else:
+            field = copy.deepcopy(field)
+
+        field.attribute = None
+        fields[name] = field
+        columns.append(column.alias(name))
+
+    meta = type('Meta', (object,), {'ordered': schema.opts.ordered})
+    return type(Schema.__name__ + 'Rows', (ma.Schema,), dict(fields, Meta=meta)), columns
+
+
+def connect(database, timeout):
+    """Get a pooled connection, wait the given seconds for a free one."""
+    expires = time.time() + timeout
+    while True:
+        try:
+            # Skip the pool's own waiting
+            return super(PooledDatabase, database).connect(reuse_if_open=True)
+        except MaxConnectionsExceeded:
+            if time.time() >= expires:
+                raise
+            time.sleep(min(POOL_WAIT_STEP, timeout))
+
+
+def release(database):
+    """Return the connection to the pool."""
+    if not database.is_closed() and not database.in_transaction():
+        database.close()
+
+
+def pool_stats(database):
+    """Get the connections pool saturation."""
+    in_use = len(database._in_use)
+    limit = database._max_connections
+    return {
+        'in_use': in_use,
+        'available': len(database._connections),
+        'max_connections': limit,
+        'saturation': limit and float(in_use) / limit,
+    }
+
 # pylama:ignore=E1102,W0212
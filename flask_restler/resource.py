@@ -3,19 +3,28 @@
 from __future__ import absolute_import
 
 import collections
+import datetime as dt
+import itertools
+import json
 import logging
 import math
 import re
+import threading
+import time
+from types import FunctionType
 
 from apispec import utils
-from flask import request, current_app, abort, Response
-from flask._compat import with_metaclass
-from flask.json import dumps
-from flask.views import View
+from flask import request, current_app, abort, Response, stream_with_context
+from flask._compat import with_metaclass, string_types
+from flask.views import View, http_method_funcs
 
 from . import APIError, logger
 from .auth import current_user
+from .compiler import compile_schema
 from .filters import Filters, FILTERS_ARG
+from .limits import Limit, Coalesce, acquire, release
+from .serializers import JSON
+from .sync import make_token, parse_since
 
 
 try:
@@ -27,8 +36,18 @@ except ImportError:
 PER_PAGE_ARG = 'per_page'
 PAGE_ARG = 'page'
 SORT_ARG = 'sort'
-INTERNAL_ARGS = set([PER_PAGE_ARG, PAGE_ARG, SORT_ARG, FILTERS_ARG])
+FIELDS_ARG = 'fields'
+SEARCH_ARG = 'q'
+SINCE_ARG = 'since'
+DRY_RUN_ARG = 'dry_run'
+GROUP_BY_ARG = 'group_by'
+AGG_ARG = 'agg'
+AGGREGATES = 'count', 'sum', 'avg', 'min', 'max'
+INTERNAL_ARGS = set([PER_PAGE_ARG, PAGE_ARG, SORT_ARG, FILTERS_ARG, FIELDS_ARG])
 RE_URL = re.compile(r'<(?:[^:<>]+:)?([^<>]+)>')
+SORTING_CACHE_SIZE = 1024
+SAFE_METHODS = set(['GET', 'HEAD', 'OPTIONS'])
+REPLICAS_WRITES_SIZE = 10000
 
 
 class ResourceOptions(object):
@@ -61,10 +80,24 @@ class ResourceOptions(object):
         if self.specs:  # noqa
             self.specs = dict(self.specs)
 
+        # Limit concurrent requests
+        self.limit = self.concurrency and Limit(self.concurrency, self.concurrency_timeout) or None
+
+        # Share responses between identical concurrent GET requests
+        self.flights = self.coalesce and Coalesce(self.coalesce_timeout) or None
+
         if self.strict:  # noqa
             if not isinstance(self.strict, collections.Iterable):
                 self.strict = INTERNAL_ARGS
             self.strict = set(self.strict) | INTERNAL_ARGS
+            if self.search:
+                self.strict.add(SEARCH_ARG)
+            if self.updated_field:
+                self.strict.add(SINCE_ARG)
+            if self.bulk:
+                self.strict.add(DRY_RUN_ARG)
+            if self.aggregations:
+                self.strict.update((GROUP_BY_ARG, AGG_ARG))
 
         # Setup endpoints
         self.endpoints = getattr(self, 'endpoints', {})
@@ -84,10 +117,91 @@ class ResourceOptions(object):
 
         # Setup sorting
         self.sorting = dict(n if isinstance(n, (list, tuple)) else (n, n) for n in self.sorting)
+        self.sorting_cache = {}
+
+        # Setup aggregations
+        self.aggregations = dict(
+            n if isinstance(n, (list, tuple)) else (n, n) for n in self.aggregations)
+
+        # Setup handlers
+        self.handlers = {
+            name.upper(): getattr(cls, name) for name in http_method_funcs if hasattr(cls, name)}
 
     def __repr__(self):
         return "<Options %s>" % self.cls
 
+    def parse_sorting(self, value):
+        """Parse the given sort param into a sorting plan."""
+        try:
+            return self.sorting_cache[value]
+        except KeyError:
+            pass
+
+        sorting = ((name.strip('-'), name.startswith('-')) for name in value.split(','))
+        sorting = tuple((self.sorting[n], d) for n, d in sorting if n in self.sorting)
+        if len(self.sorting_cache) < SORTING_CACHE_SIZE:
+            self.sorting_cache[value] = sorting
+        return sorting
+
+    def parse_aggregation(self, group_by, agg):
+        """Parse group_by and agg params into groups [(name, prop)] and aggregates
+        [(label, function, prop)]. Raise ValueError for invalid params.
+        """
+        try:
+            groups = [(name, self.aggregations[name]) for name in (
+                name.strip() for name in (group_by or '').split(',')) if name]
+            aggregates = []
+            for value in (agg or 'count').split(','):
+                func, _, name = value.strip().partition(':')
+                if func not in AGGREGATES or (func == 'count') != (not name):
+                    raise ValueError(value)
+                label = name and '%s_%s' % (func, name) or func
+                aggregates.append((label, func, name and self.aggregations[name]))
+
+        except KeyError as exc:
+            raise ValueError(exc)
+
+        return groups, aggregates
+
+
+class Replicas(object):
+    """Route reads to replicas (round-robin) and support read-your-writes windows."""
+
+    def __init__(self, replicas, window=0):
+        """Initialize the replicas.
+
+        :param replicas: A replica, a lambda or a list of them
+        :param window: Seconds to read from the primary after a client's write
+        """
+        if not isinstance(replicas, (list, tuple)):
+            replicas = [replicas]
+        self.replicas = itertools.cycle(replicas)
+        self.window = window
+        self.writes = {}
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Get a next replica."""
+        replica = next(self.replicas)
+        if isinstance(replica, FunctionType):
+            return replica()
+        return replica
+
+    def is_available(self, client):
+        """Check the client may read from replicas."""
+        return self.writes.get(client, 0) < time.time()
+
+    def wrote(self, client):
+        """Remember the client's write."""
+        if not self.window:
+            return
+
+        now = time.time()
+        with self.lock:
+            if len(self.writes) > REPLICAS_WRITES_SIZE:
+                self.writes = {k: v for k, v in self.writes.items() if v > now}
+            self.writes[client] = now + self.window
+
 
 class ResourceMeta(type):
     """Do some work for resources."""
@@ -97,6 +211,8 @@ class ResourceMeta(type):
         cls = super(ResourceMeta, mcs).__new__(mcs, name, bases, params)
         cls.methods = set([method.upper() for method in cls.methods])
         cls.meta = cls.OPTIONS_CLASS(cls)
+        cls.meta.dumper = cls.meta.compile_schema and cls.Schema and \
+            compile_schema(cls.Schema) or None
         return cls
 
 
@@ -135,12 +251,52 @@ class Resource(with_metaclass(ResourceMeta, View)):
         # Filters converter class
         filters_converter = Filters
 
+        # Rows per batch when a collection is streamed
+        batch_size = 1000
+
+        # Stream whole collections for streaming formats (NDJSON, CSV). By default only
+        # resources with the default `get` handler are streamed (custom handlers could
+        # restrict the results)
+        stream = None
+
+        # Limit concurrent requests (reject excess requests with 503 after the timeout)
+        concurrency = None
+        concurrency_timeout = 0.1
+
+        # Coalesce identical concurrent GET requests (wait for the first one at most the timeout)
+        coalesce = False
+        coalesce_timeout = 5
+
         # Strict mode (only allowed query params) set to list of names for allowed query params
         strict = False
 
         # Swagger specs
         specs = None
 
+        # Dump responses with a dump function generated for the resource schema
+        compile_schema = False
+
+        # Full-text search by `q` query param (the declaration depends on the backend)
+        search = None
+
+        # Incremental sync: a field with the modification time (naive UTC datetime) enables
+        # `since` param (a unix timestamp or a sync token from `X-Sync-Token` header)
+        updated_field = None
+
+        # Store for deleted resources (see `flask_restler.sync.Tombstones`), they are listed
+        # on the first page of `since` responses as {<key>: <value>, "_deleted": true}
+        tombstones = None
+
+        # Bulk DELETE/PATCH on the collection URL by `where` param (count only with `dry_run=1`)
+        bulk = False
+
+        # Max resources for a bulk operation
+        bulk_limit = 1000
+
+        # Fields for aggregations by `group_by` and `agg` params
+        # (e.g. ?group_by=status&agg=count,sum:amount; functions: count, sum, avg, min, max)
+        aggregations = ()
+
         # marshmallow.Schema.Meta options
         # -------------------------------
 
@@ -151,9 +307,26 @@ class Resource(with_metaclass(ResourceMeta, View)):
         """Initialize the resource."""
         self.api = api
         self.raw = raw
-        self.auth = self.collection = None
+        self.auth = self._collection = None
+        self._tombstones = []
+
+        # Headers of raw responses (pagination, sync token)
+        self.response_headers = {}
+        self._params = (), {}
         super(Resource, self).__init__(**kwargs)
 
+    @property
+    def collection(self):
+        """Load the collection only when it's required."""
+        if self._collection is None:
+            args, kwargs = self._params
+            self._collection = self.get_many(*args, **kwargs)
+        return self._collection
+
+    @collection.setter
+    def collection(self, value):
+        self._collection = value
+
     @classmethod
     def from_func(cls, func, methods=None, **params):
 
@@ -170,72 +343,269 @@ class Resource(with_metaclass(ResourceMeta, View)):
         return type(func.__name__, (cls,), params)
 
     def dispatch_request(self, *args, **kwargs):
+        """Process current request with concurrency limits."""
+        with acquire(self.api and self.api.limit, self.meta.limit) as limits:
+            response = self.process_request(*args, **kwargs)
+
+            # Hold the limits until streamed responses are sent
+            if limits and getattr(response, 'is_streamed', False):
+                held, limits[:] = limits[:], []
+                response.call_on_close(lambda: release(held))
+
+        # Remember deleted resources when the request is finished
+        if self._tombstones:
+            now = dt.datetime.utcnow()
+            for tombstone in self._tombstones:
+                self.meta.tombstones.add(self.meta.name, tombstone, now)
+
+        return response
+
+    def process_request(self, *args, **kwargs):
         """Process current request."""
-        if self.meta.strict and not (self.meta.strict >= set(request.args)):
+        meta = self.meta
+        if meta.strict and any(name not in meta.strict for name in request.args):
             raise APIError('Invalid query params.')
 
         self.auth = self.authorize(*args, **kwargs)
-        self.collection = self.get_many(*args, **kwargs)
+        if meta.flights and request.method == 'GET' and not self.raw:
+            key = self.get_coalesce_key()
+            if key is not None:
+                return meta.flights.run(key, self.make_response, *args, **kwargs)
+
+        return self.make_response(*args, **kwargs)
+
+    def get_coalesce_key(self):
+        """Identify identical requests by path, params, format and credentials.
+
+        The auth scope is not enough: `current_user.get_id()` is None without flask-login
+        and authorization callbacks often return just True.
+        """
+        get_id = getattr(self.auth, 'get_id', None)
+        scope = get_id() if callable(get_id) else self.auth
+        key = (request.path, tuple(sorted(request.args.items(multi=True))),
+               request.headers.get('Accept'), request.headers.get('Authorization'),
+               request.headers.get('Cookie'), scope)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def make_response(self, *args, **kwargs):
+        """Load resources and make a response."""
+        meta = self.meta
+        self._params = args, dict(kwargs)
 
         kwargs['resource'] = resource = self.get_one(*args, **kwargs)
 
         endpoint = kwargs.pop('endpoint', None)
-        if endpoint and hasattr(self, endpoint):
-            method = getattr(self, endpoint)
+        if endpoint and endpoint in meta.endpoints:
             logger.debug('Loaded endpoint: %s', endpoint)
-            response = method(*args, **kwargs)
+            response = meta.endpoints[endpoint][0](self, *args, **kwargs)
             return self.to_json_response(response)
 
+        handler = meta.handlers.get(request.method)
+        if handler is None:
+            return abort(405)
+
+        if request.method in ('DELETE', 'PATCH') and resource is None and meta.bulk:
+            return self.to_json_response(self.bulk(*args, **kwargs))
+
+        if request.method == 'DELETE' and meta.tombstones and resource is not None:
+            self._tombstones = [
+                tombstone for tombstone in (self.get_tombstone(resource),) if tombstone]
+
         headers = {}
+        tombstones = None
 
         if request.method == 'GET' and resource is None:
 
             # Filter resources
             self.collection = self.filter(self.collection, *args, **kwargs)
 
-            # Sort resources
-            if SORT_ARG in request.args:
-                sorting = ((name.strip('-'), name.startswith('-'))
-                           for name in request.args[SORT_ARG].split(','))
-                sorting = (
-                    (self.meta.sorting.get(n), d) for n, d in sorting if n in self.meta.sorting)
-                self.collection = self.sort(self.collection, *sorting, **kwargs)
-
-            # Paginate resources
-            if self.meta.per_page:
-                try:
-                    per_page = int(request.args.get(PER_PAGE_ARG, self.meta.per_page))
-                    if per_page:
-                        page = int(request.args.get(PAGE_ARG, 0))
-                        offset = page * per_page
-                        self.collection, total = self.paginate(offset, per_page)
-                        headers = make_pagination_headers(
-                            per_page, page, total, self.meta.page_link_header)
-                except ValueError:
-                    raise APIError('Pagination params are invalid.')
+            tombstones = self.apply_since(headers, *args, **kwargs)
+            self.apply_search(*args, **kwargs)
+
+            response = self.aggregate_response()
+            if response is not None:
+                return response
+
+            self.apply_sorting(**kwargs)
+
+            response = self.stream_response(handler, headers, tombstones)
+            if response is not None:
+                return response
+
+            self.apply_pagination(headers)
 
         if logger.level <= logging.DEBUG:
-            logger.debug('Collection: %r', self.collection)
+            logger.debug('Collection: %r', self._collection)
             logger.debug('Params: %r', kwargs)
 
-        try:
-            method = getattr(self, request.method.lower())
-        except AttributeError:
-            return abort(405)
+        response = handler(self, *args, **kwargs)
+        if tombstones and isinstance(response, list):
+            response = response + [dict(tombstone, _deleted=True) for tombstone in tombstones]
 
-        response = method(*args, **kwargs)
         return self.to_json_response(response, headers=headers)
 
+    def apply_since(self, headers, *args, **kwargs):
+        """Load changes only (`since` param). Add a sync token to headers, return tombstones."""
+        meta = self.meta
+        if not (meta.updated_field and request.args.get(SINCE_ARG)):
+            return None
+
+        now = dt.datetime.utcnow()
+        try:
+            since = parse_since(request.args[SINCE_ARG])
+        except ValueError:
+            raise APIError('Invalid since param.')
+
+        tombstones = None
+        self.collection = self.changed_since(self.collection, since, *args, **kwargs)
+        if meta.tombstones and str(request.args.get(PAGE_ARG) or 0) == '0':
+            tombstones = meta.tombstones.since(meta.name, since)
+            if tombstones is None:
+                raise APIError('Sync token is expired, load the whole collection.',
+                               status_code=410)
+        headers['X-Sync-Token'] = make_token(now)
+        return tombstones
+
+    def apply_search(self, *args, **kwargs):
+        """Search resources (`q` param)."""
+        if self.meta.search and request.args.get(SEARCH_ARG):
+            self.collection = self.search(
+                self.collection, request.args[SEARCH_ARG], *args, **kwargs)
+
+    def aggregate_response(self):
+        """Aggregate resources (`group_by` and `agg` params). Return None when not requested."""
+        meta = self.meta
+        if not (meta.aggregations and (GROUP_BY_ARG in request.args or AGG_ARG in request.args)):
+            return None
+
+        try:
+            groups, aggregates = meta.parse_aggregation(
+                request.args.get(GROUP_BY_ARG), request.args.get(AGG_ARG))
+        except ValueError:
+            raise APIError('Invalid aggregation params.')
+        return self.to_json_response(self.group(self.collection, groups, aggregates))
+
+    def apply_sorting(self, **kwargs):
+        """Sort resources (`sort` param)."""
+        if SORT_ARG in request.args:
+            sorting = self.meta.parse_sorting(request.args[SORT_ARG])
+            self.collection = self.sort(self.collection, *sorting, **kwargs)
+
+    def stream_response(self, handler, headers=None, tombstones=None):
+        """Stream whole collection for streaming formats. Return None when not streamed."""
+        meta = self.meta
+        serializer = self.get_serializer()
+        if serializer.stream and not self.raw and (
+                meta.stream or meta.stream is None and handler == Resource.get):
+            return self.to_stream_response(serializer, headers=headers, tombstones=tombstones)
+        return None
+
+    def apply_pagination(self, headers):
+        """Paginate resources. Add pagination headers."""
+        meta = self.meta
+        if not meta.per_page:
+            return
+
+        try:
+            per_page = int(request.args.get(PER_PAGE_ARG, meta.per_page))
+            if per_page:
+                page = int(request.args.get(PAGE_ARG, 0))
+                offset = page * per_page
+                self.collection, total = self.paginate(offset, per_page)
+                headers.update(make_pagination_headers(
+                    per_page, page, total, meta.page_link_header))
+        except ValueError:
+            raise APIError('Pagination params are invalid.')
+
+    @property
+    def serializers(self):
+        """Get available request/response formats."""
+        if self.api is not None:
+            return self.api.serializers
+        return {JSON.mimetype: JSON}
+
+    def get_serializer(self):
+        """Negotiate response format by Accept header."""
+        serializers = self.serializers
+        mimetype = request.accept_mimetypes.best_match(serializers)
+
+        # Wildcards (*/*, text/*) select JSON, other formats should be requested explicitly
+        if mimetype not in [value.lower() for value in request.accept_mimetypes.values()]:
+            mimetype = None
+        return serializers.get(mimetype, JSON)
+
+    def get_data(self):
+        """Load request body by Content-Type."""
+        serializer = self.serializers.get(request.mimetype)
+        if serializer is None or serializer is JSON:
+            return request.json
+
+        try:
+            return serializer.loads(request.get_data())
+        except Exception:
+            raise APIError('Invalid request body.')
+
     def to_json_response(self, response, headers=None):
         """Serialize simple response to Flask response."""
-        if self.raw or isinstance(response, Response):
+        if self.raw:
+            self.response_headers = dict(headers or {})
             return response
+
+        if isinstance(response, Response):
+            if headers:
+                response.headers.extend(headers)
+            return response
+
+        serializer = self.get_serializer()
         response = current_app.response_class(
-            dumps(response, indent=2), mimetype='application/json')
+            serializer.dumps(response), mimetype=serializer.mimetype)
         if headers:
             response.headers.extend(headers)
         return response
 
+    def to_stream_response(self, serializer, headers=None, tombstones=None):
+        """Stream the whole collection to Flask response (deleted resources at the end)."""
+        rows = (row for batch in self.stream_batches() for row in batch)
+        columns = self.get_columns(self.get_schema())
+        if tombstones:
+            rows = itertools.chain(
+                rows, (dict(tombstone, _deleted=True) for tombstone in tombstones))
+            if columns is not None:
+                columns = columns + ['_deleted']
+
+        response = current_app.response_class(
+            stream_with_context(serializer.dumps_stream(rows, columns=columns)),
+            mimetype=serializer.mimetype)
+        if headers:
+            response.headers.extend(headers)
+        return response
+
+    def stream_batches(self):
+        """Dump the streamed collection by batches with `to_simple` (keep its overrides)."""
+        rows = iter(self.stream(self.collection))
+        while True:
+            batch = list(itertools.islice(rows, self.meta.batch_size))
+            if not batch:
+                return
+            yield self.to_simple(batch, many=True)
+
+    def get_columns(self, schema=None):
+        """Get columns for tabular formats from the schema or the fields param."""
+        columns = None
+        if schema:
+            columns = [getattr(field, 'dump_to', None) or name
+                       for name, field in schema.fields.items() if not field.load_only]
+
+        if FIELDS_ARG in request.args:
+            fields = [name.strip() for name in request.args[FIELDS_ARG].split(',')]
+            columns = [name for name in fields if columns is None or name in columns]
+
+        return columns
+
     def authorize(self, *args, **kwargs):
         """Default authorization method."""
         if self.api is not None:
@@ -258,6 +628,110 @@ class Resource(with_metaclass(ResourceMeta, View)):
         """Filter collection."""
         return self.meta.filters.filter(collection, self, *args, **kwargs)
 
+    def search(self, collection, query, *args, **kwargs):
+        """Search collection by the given full-text query."""
+        return collection
+
+    def bulk(self, *args, **kwargs):
+        """Delete or update all the resources selected by `where` param."""
+        where = request.args.get(FILTERS_ARG)
+        try:
+            if isinstance(where, string_types):
+                where = json.loads(where)
+        except ValueError:
+            where = None
+
+        collection = self.filter(self.collection, *args, **kwargs)
+
+        # Every condition should be applied, otherwise more resources would be affected
+        applied = request.filters
+        if not where or not isinstance(where, dict) or any(
+                name not in applied or isinstance(value, dict) and len(value) != len(applied[name])
+                for name, value in where.items()):
+            raise APIError('Bulk operations require a valid where param.')
+
+        count = self.bulk_count(collection)
+        if self.meta.bulk_limit and count > self.meta.bulk_limit:
+            raise APIError('Too many resources: %d (the limit is %d).' % (
+                count, self.meta.bulk_limit))
+
+        if request.args.get(DRY_RUN_ARG):
+            return {'count': count, 'dry_run': True}
+
+        logger.debug('Bulk %s: %r', request.method, where)
+        if request.method == 'DELETE':
+            if self.meta.tombstones:
+                self._tombstones = self.get_tombstones(collection)
+            return {'count': self.bulk_delete(collection)}
+
+        values = self.load_values(self.get_data() or {}, **kwargs)
+        if not values:
+            raise APIError('Bad request', payload={'errors': {'_schema': ['No values.']}})
+        return {'count': self.bulk_update(collection, values)}
+
+    def bulk_count(self, collection):
+        """Count resources for a bulk operation."""
+        return len(collection)
+
+    def bulk_delete(self, collection):
+        """Delete the given resources, return the number of deleted resources."""
+        collection = list(collection)
+        for resource in collection:
+            self.delete(resource=resource)
+        return len(collection)
+
+    def bulk_update(self, collection, values):
+        """Update the given resources, return the number of updated resources."""
+        collection = list(collection)
+        for resource in collection:
+            if isinstance(resource, dict):
+                resource.update(values)
+            else:
+                for name, value in values.items():
+                    setattr(resource, name, value)
+            self.save(resource)
+        return len(collection)
+
+    def group(self, collection, groups, aggregates):
+        """Group the collection and calculate aggregates, return a list of dicts."""
+        def get(obj, prop):
+            return obj.get(prop) if isinstance(obj, dict) else getattr(obj, prop, None)
+
+        rows = collections.OrderedDict()
+        for obj in collection:
+            rows.setdefault(tuple(get(obj, prop) for _, prop in groups), []).append(obj)
+
+        functions = {'sum': sum, 'min': min, 'max': max, 'avg': lambda v: sum(v) / float(len(v))}
+        result = []
+        for key, objs in rows.items():
+            row = dict(zip([name for name, _ in groups], key))
+            for label, func, prop in aggregates:
+                if func == 'count':
+                    row[label] = len(objs)
+                    continue
+                values = [value for value in (get(obj, prop) for obj in objs) if value is not None]
+                row[label] = functions[func](values) if values else None
+            result.append(row)
+        return result
+
+    def changed_since(self, collection, since, *args, **kwargs):
+        """Filter resources changed at the given time or later."""
+        name = self.meta.updated_field
+
+        def changed(obj):
+            value = obj.get(name) if isinstance(obj, dict) else getattr(obj, name, None)
+            return value is not None and value >= since
+
+        return [obj for obj in collection if changed(obj)]
+
+    def get_tombstone(self, resource):
+        """Get a dict which identifies the deleted resource for sync clients."""
+        return None
+
+    def get_tombstones(self, collection):
+        """Get tombstones for the resources deleted in bulk."""
+        return [tombstone for tombstone in map(self.get_tombstone, collection) if tombstone]
+
     def sort(self, collection, *sorting, **kwargs):
         """Sort collection."""
         logger.debug('Sort collection: %r', sorting)
@@ -271,6 +745,21 @@ class Resource(with_metaclass(ResourceMeta, View)):
             raise APIError('Bad request', payload={'errors': errors})
         return resource
 
+    def load_values(self, data, **kwargs):
+        """Validate a partial payload and get the loaded values without making objects.
+
+        `post_load` hooks are skipped (they usually make objects), override the method to
+        transform the values.
+        """
+        schema = self.get_schema(**kwargs)
+        if schema is None:
+            return dict(data)
+
+        values, errors = schema._do_load(data, partial=True, postprocess=False)
+        if errors:
+            raise APIError('Bad request', payload={'errors': errors})
+        return values
+
     def save(self, resource):
         """Create a resource."""
         return resource
@@ -278,7 +767,17 @@ class Resource(with_metaclass(ResourceMeta, View)):
     def to_simple(self, data, many=False, **kwargs):
         """Serialize response to simple object (list, dict)."""
         schema = self.get_schema(many=many, **kwargs)
-        return schema.dump(data, many=many).data if schema else data
+        return self.dump(schema, data, many=many) if schema else data
+
+    def dump(self, schema, data, many=False):
+        """Dump data with the schema (use the compiled schema when it's enabled)."""
+        if self.meta.dumper is not None:
+            return self.meta.dumper(schema, data, many=many)
+        return schema.dump(data, many=many).data
+
+    def stream(self, collection):
+        """Iterate the whole collection by batches."""
+        return iter(collection)
 
     def paginate(self, offset, limit):
         """Paginate results."""
@@ -293,7 +792,7 @@ class Resource(with_metaclass(ResourceMeta, View)):
         return self.to_simple(self.collection, many=True, **kwargs)
 
     def post(self, **kwargs):
-        data = request.json or {}
+        data = self.get_data() or {}
         resource = self.load(data, **kwargs)
         resource = self.save(resource)
         logger.debug('Create a resource (%r)', kwargs)
@@ -315,14 +814,31 @@ class Resource(with_metaclass(ResourceMeta, View)):
             raise APIError('Resource not found', status_code=404)
         self.collection.remove(resource)
 
+    @classmethod
+    def get_indexes(cls, table):
+        """Get indexes of the given table as a list of (columns, unique).
+
+        Return None when indexes are unknown.
+        """
+        return None
+
+    @classmethod
+    def get_column(cls, field):
+        """Get (table, column) for the given filter or sorting."""
+        return None
+
     @classmethod
     def update_specs(cls, specs):
         if cls.Schema:
             specs.definition(cls.meta.name, schema=cls.Schema)
 
+        # Advertise formats
+        formats = {
+            name: specs.options[name] for name in ('consumes', 'produces') if name in specs.options}
+
         operations = utils.load_operations_from_docstring(cls.__doc__)
         specs.add_path(RE_URL.sub(r'{\1}', cls.meta.url), operations=cls.update_operations_specs(
-            operations, ('GET', 'POST'),
+            operations, ('GET', 'POST'), **formats
         ))
 
         if cls.meta.url_detail:
@@ -333,7 +849,7 @@ class Resource(with_metaclass(ResourceMeta, View)):
                     'description': 'Resource Identifier',
                     'type': 'string',
                     'required': True,
-                }]
+                }], **formats
             )
             specs.add_path(RE_URL.sub(r'{\1}', cls.meta.url_detail), operations=ops)
 
@@ -341,8 +857,8 @@ class Resource(with_metaclass(ResourceMeta, View)):
             specs.add_path(
                 RE_URL.sub(r'{\1}', "%s%s" % (cls.meta.url.rstrip('/'), url_)),
                 operations=cls.update_operations_specs(
-                    operations, params_.get('methods', ('GET',)), method=getattr(cls, name_, None)
-                ))
+                    operations, params_.get('methods', ('GET',)), method=getattr(cls, name_, None),
+                    **formats))
 
     @classmethod
     def update_operations_specs(cls, operations, methods, method=None, **specs):
@@ -398,6 +914,11 @@ class Resource(with_metaclass(ResourceMeta, View)):
         return result
 
 
+def prefers_minimal():
+    """Check the client doesn't need a response body (`Prefer: return=minimal`)."""
+    return 'return=minimal' in request.headers.get('Prefer', '')
+
+
 def make_pagination_headers(limit, curpage, total, link_header=True):
     """Return Link Hypermedia Header."""
     lastpage = int(math.ceil(1.0 * total / limit) - 1)
@@ -1,7 +1,109 @@
-"""Run any resource in interactive mode."""
+"""Run resources directly (without WSGI environ and URL parsing)."""
+
+from __future__ import absolute_import
+
+from flask import _app_ctx_stack, _request_ctx_stack
+from werkzeug.datastructures import Headers, MIMEAccept, MultiDict
+from werkzeug.http import parse_accept_header
+
+
+class Request(object):
+
+    """A minimal request for direct resource calls."""
+
+    accept_mimetypes = MIMEAccept()
+    blueprint = endpoint = None
+    headers = Headers()
+    mimetype = 'application/json'
+    remote_addr = None
+
+    def __init__(self, method='GET', path='/', args=None, data=None, headers=None,
+                 remote_addr=None, blueprint=None):
+        """Initialize the request.
+
+        :param args: Parsed query params (`where` could be a dict)
+        :param data: Parsed request body
+        """
+        self.blueprint = blueprint
+        self.method = method.upper()
+        self.path = path
+        self.args = args if isinstance(args, MultiDict) else MultiDict(args or {})
+        self.json = data
+        self.filters = {}
+        if headers is not None:
+            self.headers = headers
+            if headers.get('Accept'):
+                self.accept_mimetypes = parse_accept_header(headers['Accept'], MIMEAccept)
+        self.remote_addr = remote_addr
+
+    def __repr__(self):
+        return '<Request %s %s>' % (self.method, self.path)
+
+    def get_data(self):
+        return b''
+
+
+class RequestContext(object):
+
+    """A minimal request context."""
+
+    url_adapter = None
+
+    def __init__(self, url_adapter=None):
+        self.url_adapter = url_adapter
+        self.request = None
+        self.session = {}
 
 
 class Runner(object):
 
-    def __init__(self, Resource):
-        self.resource = Resource()
+    """Run resources directly.
+
+    One application and request context is reused for all calls::
+
+        with Runner(api) as run:
+            users = run(UserResource, args={'where': {'is_active': True}})
+            user = run(UserResource, kwargs={'user': 1})
+
+    """
+
+    def __init__(self, api, headers=None, remote_addr=None, session=None, url_adapter=None):
+        """Initialize the runner.
+
+        :param headers: Headers for all calls (e.g. to reuse credentials of a real request)
+        :param url_adapter: URL adapter for `url_for` (e.g. the adapter of a real request)
+        """
+        self.api = api
+        self.headers = headers
+        self.remote_addr = remote_addr
+        self.response_headers = {}
+        self.ctx = RequestContext(url_adapter)
+        if session is not None:
+            self.ctx.session = session
+        self.app_ctx = None
+
+    def __enter__(self):
+        app = self.api.app
+        top = _app_ctx_stack.top
+        if top is None or top.app is not app:
+            self.app_ctx = app.app_context()
+            self.app_ctx.push()
+
+        _request_ctx_stack.push(self.ctx)
+        return self
+
+    def __exit__(self, *args):
+        _request_ctx_stack.pop()
+        if self.app_ctx is not None:
+            self.app_ctx.pop()
+            self.app_ctx = None
+
+    def __call__(self, Resource, method='GET', path='/', args=None, data=None, kwargs=None):
+        """Call the given resource. Headers of the response are kept in `response_headers`."""
+        self.ctx.request = Request(
+            method, path, args, data, self.headers, self.remote_addr, self.api.name)
+        resource = Resource(self.api, raw=True)
+        try:
+            return resource.dispatch_request(**(kwargs or {}))
+        finally:
+            self.response_headers = resource.response_headers
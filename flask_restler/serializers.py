@@ -0,0 +1,208 @@
+"""Support request and response formats."""
+
+from __future__ import absolute_import
+
+import csv
+from decimal import Decimal
+from itertools import chain
+
+from flask import current_app, json
+from flask._compat import string_types, text_type, PY2
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+# Spreadsheets evaluate cells starting with the chars as formulas
+FORMULA_PREFIXES = '=', '+', '-', '@', '\t', '\r'
+
+
+class Serializer(object):
+
+    """Base serializer class."""
+
+    mimetype = None
+
+    # stream: Stream whole collections instead of pagination
+    stream = False
+
+    # chunk_size: Rows per chunk for streaming
+    chunk_size = 100
+
+    def dumps(self, data):
+        """Serialize simple data (list, dict) to bytes."""
+        raise NotImplementedError
+
+    def dumps_row(self, row):
+        """Serialize a row for streaming."""
+        raise NotImplementedError
+
+    def dumps_stream(self, rows, columns=None):
+        """Serialize the given rows by chunks."""
+        chunk = []
+        for row in rows:
+            chunk.append(self.dumps_row(row))
+            if len(chunk) >= self.chunk_size:
+                yield ''.join(chunk)
+                chunk = []
+
+        if chunk:
+            yield ''.join(chunk)
+
+    def loads(self, data):
+        """Deserialize request body."""
+        raise NotImplementedError
+
+    def __repr__(self):
+        return '<Serializer %s>' % self.mimetype
+
+
+class JSONSerializer(Serializer):
+
+    """Serialize JSON."""
+
+    mimetype = 'application/json'
+
+    def dumps(self, data):
+        return json.dumps(data, indent=2, default=default)
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class NDJSONSerializer(Serializer):
+
+    """Stream newline-delimited JSON."""
+
+    mimetype = 'application/x-ndjson'
+    stream = True
+
+    def dumps(self, data):
+        if not isinstance(data, list):
+            data = [data]
+        return ''.join(self.dumps_row(row) for row in data)
+
+    def dumps_row(self, row):
+        return json.dumps(row, default=default) + '\n'
+
+    def loads(self, data):
+        return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+
+class CSVSerializer(Serializer):
+
+    """Stream CSV."""
+
+    mimetype = 'text/csv'
+    stream = True
+
+    def dumps(self, data):
+        if not isinstance(data, list):
+            data = [data]
+        return ''.join(self.dumps_stream(data))
+
+    def dumps_stream(self, rows, columns=None):
+        rows = iter(rows)
+        if columns is None:
+            try:
+                first = next(rows)
+            except StopIteration:
+                return
+
+            columns = sorted(first) if isinstance(first, dict) else None
+            rows = chain([first], rows)
+
+        buf = StringIO()
+        writer = csv.writer(buf)
+        if columns:
+            writer.writerow([encode_cell(name) for name in columns])
+
+        for num, row in enumerate(rows, 1):
+            writer.writerow(self.dumps_row(row, columns))
+            if num % self.chunk_size == 0:
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+
+        yield buf.getvalue()
+
+    def dumps_row(self, row, columns=None):
+        if columns is None:
+            return [dumps_cell(row)]
+        return [dumps_cell(row.get(name)) for name in columns]
+
+
+class MsgPackSerializer(Serializer):
+
+    """Serialize MessagePack."""
+
+    mimetype = 'application/msgpack'
+
+    def __init__(self):
+        if msgpack is None:
+            raise ImportError('Msgpack should be installed to use the serializer.')
+
+    def dumps(self, data):
+        return msgpack.packb(data, default=default, use_bin_type=True)
+
+    def loads(self, data):
+        return msgpack.unpackb(data, raw=False)
+
+
+class CBORSerializer(Serializer):
+
+    """Serialize CBOR."""
+
+    mimetype = 'application/cbor'
+
+    def __init__(self):
+        if cbor2 is None:
+            raise ImportError('Cbor2 should be installed to use the serializer.')
+
+    def dumps(self, data):
+        return cbor2.dumps(data, default=lambda encoder, obj: encoder.encode(default(obj)))
+
+    def loads(self, data):
+        return cbor2.loads(data)
+
+
+def dumps_cell(value):
+    """Prepare a value for CSV cell (escape formulas)."""
+    if value is None:
+        return ''
+    if isinstance(value, (dict, list)):
+        return encode_cell(json.dumps(value))
+    if isinstance(value, string_types) and value.startswith(FORMULA_PREFIXES):
+        value = "'" + value
+    return encode_cell(value)
+
+
+def encode_cell(value):
+    """Encode text to UTF-8 for Python 2 csv module (it writes byte strings only)."""
+    if PY2 and isinstance(value, text_type):
+        return value.encode('utf-8')
+    return value
+
+
+def default(obj):
+    """Convert unsupported objects the same way as Flask JSON encoder does (decimals too)."""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return current_app.json_encoder().default(obj)
+
+
+JSON = JSONSerializer()
+NDJSON = NDJSONSerializer()
+CSV = CSVSerializer()
@@ -1,12 +1,23 @@
 from __future__ import absolute_import
 
+import copy
 from types import FunctionType
-from sqlalchemy import func
+from cached_property import cached_property
+from flask import request, current_app
+import marshmallow as ma
+from sqlalchemy import func, or_, table, column, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query
 from sqlalchemy.orm.attributes import QueryableAttribute
+from sqlalchemy.orm.interfaces import MANYTOONE
+from sqlalchemy.sql.functions import FunctionElement
 from flask._compat import string_types
 
-from .filters import Filter as VanilaFilter, Filters
-from .resource import ResourceOptions, Resource, APIError, logger
+from .compiler import compile_schema
+from .filters import Filter as VanilaFilter, Filters, fts_query
+from .resource import (
+    ResourceOptions, Resource, APIError, logger, Replicas, SAFE_METHODS, SORT_ARG,
+    prefers_minimal)
 
 
 try:
@@ -40,14 +51,14 @@ class Filter(VanilaFilter):
 
     def apply(self, collection, ops, view=None, **kwargs):
         if self.mfield is not None and view is None:
-            return collection
+            return self.skip(collection)
 
         logger.debug('Apply filter %s (%r)', self.name, ops)
 
         mfield = self.mfield if self.mfield is not None else getattr(
             view.meta.model, self.name, None)
         if mfield is None:
-            return collection
+            return self.skip(collection)
         collection = collection.filter(*(op(mfield, val) for op, val in ops))
         return collection
 
@@ -57,6 +68,48 @@ class ModelFilters(Filters):
     FILTER_CLASS = Filter
 
 
+class FTS5(object):
+
+    """Search with a SQLite FTS5 table which rowids are the model's primary keys.
+
+    ::
+
+        class Meta:
+            search = FTS5('user_fts')
+
+    """
+
+    def __init__(self, name, rowid='rowid'):
+        self.name = name
+        self.table = table(name, column(rowid), column('rank'))
+        self.rowid = self.table.c[rowid]
+
+    def search(self, collection, primary_key, query, rank=True):
+        """Join the FTS table and order results by rank."""
+        collection = collection.join(self.table, self.rowid == primary_key).filter(
+            literal_column(self.name).match(fts_query(query)))
+        return collection.order_by(self.table.c.rank) if rank else collection
+
+
+class plain_match(FunctionElement):
+
+    """Match a column with user input (`plainto_tsquery` for Postgres)."""
+
+    name = 'plain_match'
+
+
+@compiles(plain_match)
+def compile_plain_match(element, compiler, **kwargs):
+    column, query = element.clauses
+    return compiler.process(column.match(query), **kwargs)
+
+
+@compiles(plain_match, 'postgresql')
+def compile_plain_match_postgresql(element, compiler, **kwargs):
+    column, query = element.clauses
+    return compiler.process(column.op('@@')(func.plainto_tsquery(query)), **kwargs)
+
+
 class ModelResourceOptions(ResourceOptions):
 
     def __init__(self, cls):
@@ -67,10 +120,14 @@ class ModelResourceOptions(ResourceOptions):
         self.sorting = dict(
             (isinstance(n, QueryableAttribute) and n.name or n, prop)
             for (n, prop) in self.sorting.items())
+        self.aggregations = dict(
+            (isinstance(n, QueryableAttribute) and n.name or n, prop)
+            for (n, prop) in self.aggregations.items())
 
         self.name = (self.meta and getattr(self.meta, 'name', None)) or \
             self.model and self.model.__tablename__ or self.name
 
+        self.row_schema = self.row_columns = self.row_dumper = None
         if not self.model:
             return None
 
@@ -86,6 +143,18 @@ class ModelResourceOptions(ResourceOptions):
         if not self.session and hasattr(self.model, 'query'):
             self.session = self.model.query.session
 
+        if self.read_session and not isinstance(self.read_session, Replicas):
+            self.read_session = Replicas(self.read_session, self.read_your_writes)
+
+        if self.read_mode == 'rows':
+            self.row_schema, self.row_columns = make_row_schema(cls.Schema, self.model)
+            if self.row_schema is None:
+                logger.warning('%s: Schema has fields which are not columns, use ORM reads.', cls)
+                self.read_mode = 'orm'
+
+            elif self.compile_schema:
+                self.row_dumper = compile_schema(self.row_schema)
+
     @property
     def session(self):
         """Support lambdas as session."""
@@ -112,8 +181,120 @@ class ModelResource(Resource):
         schema = {}
         session = None
 
+        # Sessions for GET/HEAD requests (a session, a lambda or a list for round-robin)
+        read_session = None
+
+        # Seconds to read from the primary session after the client's write
+        read_your_writes = 0
+
+        # Read mode for collections: 'orm' (load model instances) or 'rows' (query only
+        # the serialized columns and dump the rows without model instances)
+        read_mode = 'orm'
+
+        # Full-text search: columns to match (Postgres tsvector with plainto_tsquery, MySQL
+        # fulltext indexes) or FTS5('table_name') for SQLite
+        search = None
+
+        # PATCH with a single UPDATE statement without loading the resource
+        # (`post_load` hooks of the schema are skipped)
+        # (skip the response body with `Prefer: return=minimal` header)
+        fast_patch = False
+
+    @cached_property
+    def session(self):
+        """Get the session once per request. Use read replicas for safe requests."""
+        replicas = self.meta.read_session
+        if replicas and request.method in SAFE_METHODS and \
+                replicas.is_available(request.remote_addr):
+            return replicas.get()
+        return self.meta.session
+
+    def process_request(self, *args, **kwargs):
+        """Process the request as a unit of work.
+
+        Changes are flushed by the resource's methods and committed once at the end of
+        the request. Rollback the session on any error.
+        """
+        session = self.session
+        if session is None:
+            return super(ModelResource, self).process_request(*args, **kwargs)
+
+        try:
+            response = super(ModelResource, self).process_request(*args, **kwargs)
+            if request.method not in SAFE_METHODS:
+                session.commit()
+                if self.meta.read_session:
+                    self.meta.read_session.wrote(request.remote_addr)
+            return response
+
+        except Exception:
+            session.rollback()
+            raise
+
+    def savepoint(self):
+        """Begin a nested transaction. Useful for custom endpoints.
+
+        ::
+
+            @route('/import', methods=['POST'])
+            def import_users(self, **kwargs):
+                for data in request.json:
+                    try:
+                        with self.savepoint():
+                            self.save(self.load(data))
+                    except APIError:
+                        continue
+
+        """
+        return self.session.begin_nested()
+
     def get_many(self, *args, **kwargs):
-        return self.meta.session.query(self.meta.model).filter()
+        return self.session.query(self.meta.model).filter()
+
+    def search(self, collection, query, *args, **kwargs):
+        """Search with native full-text indexes."""
+        search = self.meta.search
+        if isinstance(search, FTS5):
+            return search.search(
+                collection, self.meta.primary_key, query, rank=SORT_ARG not in request.args)
+
+        if isinstance(search, (string_types, QueryableAttribute)):
+            search = search,
+
+        columns = [getattr(self.meta.model, c) if isinstance(c, string_types) else c
+                   for c in search]
+        return collection.filter(or_(*[plain_match(c, query) for c in columns]))
+
+    def changed_since(self, collection, since, *args, **kwargs):
+        """Filter resources changed at the given time or later."""
+        return collection.filter(getattr(self.meta.model, self.meta.updated_field) >= since)
+
+    def get_tombstone(self, resource):
+        """Identify the deleted resource by its primary key."""
+        key = self.meta.primary_key.key
+        return {key: getattr(resource, key)}
+
+    def get_tombstones(self, collection):
+        """Select only primary keys of the resources deleted in bulk."""
+        key = self.meta.primary_key.key
+        return [{key: row[0]} for row in collection.with_entities(self.meta.primary_key)]
+
+    def group(self, collection, groups, aggregates):
+        """Aggregate the collection with GROUP BY."""
+        model = self.meta.model
+
+        def column(prop):
+            return getattr(model, prop) if isinstance(prop, string_types) else prop
+
+        columns = [column(prop).label(name) for name, prop in groups]
+        entities = columns + [
+            (func.count() if name == 'count' else getattr(func, name)(column(prop))).label(label)
+            for label, name, prop in aggregates]
+        rows = collection.with_entities(*entities).order_by(None)
+        if columns:
+            rows = rows.group_by(*columns).order_by(*columns)
+        names = [entity.key for entity in entities]
+        return [dict(zip(names, row)) for row in rows]
 
     def sort(self, collection, *sorting, **kwargs):
         sorting_ = []
@@ -139,6 +320,10 @@ class ModelResource(Resource):
         if not resource:
             return None
 
+        # The resource is updated by `patch`
+        if self.meta.fast_patch and request.method == 'PATCH':
+            return resource
+
         resource = self.collection.filter(self.meta.primary_key == resource).first()
         if resource is None:
             raise APIError('Resource not found', status_code=404)
@@ -146,22 +331,168 @@ class ModelResource(Resource):
         return resource
 
     def get_schema(self, resource=None, **kwargs):
-        return self.Schema(session=self.meta.session, instance=resource)
+        return self.Schema(session=self.session, instance=resource)
+
+    def to_simple(self, data, many=False, **kwargs):
+        """Dump collections from rows in the rows read mode."""
+        if many and self.meta.read_mode == 'rows' and isinstance(data, Query) and \
+                request.method in SAFE_METHODS:
+            return self.dump_rows(data)
+        return super(ModelResource, self).to_simple(data, many=many, **kwargs)
+
+    def dump_rows(self, query):
+        """Query only the serialized columns and dump the rows."""
+        rows = query.with_entities(*self.meta.row_columns)
+        names = [column.key for column in self.meta.row_columns]
+        rows = [dict(zip(names, row)) for row in rows]
+        schema = self.meta.row_schema()
+        if self.meta.row_dumper is not None:
+            return self.meta.row_dumper(schema, rows, many=True)
+        return schema.dump(rows, many=True).data
 
     def save(self, resource):
         """Save resource to DB."""
-        self.meta.session.add(resource)
-        self.meta.session.commit()
+        self.session.add(resource)
+        self.session.flush()
         return resource
 
+    def patch(self, resource=None, **kwargs):
+        """Update a resource (with a single UPDATE statement when `Meta.fast_patch` is set)."""
+        if not self.meta.fast_patch:
+            return super(ModelResource, self).patch(resource=resource, **kwargs)
+
+        if resource is None:
+            raise APIError('Resource not found', status_code=404)
+
+        values = self.load_values(self.get_data() or {}, **kwargs)
+        query = self.bulk_query(self.collection.filter(self.meta.primary_key == resource))
+        count = self.bulk_update(query, values) if values else query.count()
+        if not count:
+            raise APIError('Resource not found', status_code=404)
+
+        if prefers_minimal():
+            return current_app.response_class(status=204)
+
+        return self.to_simple(query.first(), **kwargs)
+
     def delete(self, resource=None, **kwargs):
         """Delete a resource."""
         if resource is None:
             raise APIError('Resource not found', status_code=404)
-        self.meta.session.delete(resource)
-        self.meta.session.commit()
+        self.session.delete(resource)
+
+    def load_values(self, data, **kwargs):
+        """Load values for UPDATE statements (many-to-one relationships as foreign keys).
+
+        Other relationships can't be updated by UPDATE statements and are rejected.
+        """
+        values = super(ModelResource, self).load_values(data, **kwargs)
+        mapper = inspect(self.meta.model)
+        errors = {
+            name: ['The relationship is not supported by fast PATCH.'] for name in values
+            if name in mapper.relationships and
+            mapper.relationships[name].direction is not MANYTOONE}
+        if errors:
+            raise APIError('Bad request', payload={'errors': errors})
+
+        for name, value in list(values.items()):
+            prop = mapper.attrs.get(name)
+            if getattr(prop, 'direction', None) is MANYTOONE:
+                del values[name]
+                for local, remote in prop.local_remote_pairs:
+                    values[mapper.get_property_by_column(local).key] = getattr(
+                        value, prop.mapper.get_property_by_column(remote).key, None)
+        return values
+
+    def bulk_count(self, collection):
+        return collection.count()
+
+    def bulk_delete(self, collection):
+        """Delete the resources with one DELETE statement."""
+        return self.bulk_query(collection).delete(synchronize_session=False)
+
+    def bulk_update(self, collection, values):
+        """Update the resources with one UPDATE statement."""
+        return self.bulk_query(collection).update(values, synchronize_session=False)
+
+    def bulk_query(self, collection):
+        """Prepare the collection for DELETE/UPDATE (select joined collections by primary keys)."""
+        if not collection._from_obj:
+            return collection
+        pk = self.meta.primary_key
+        return self.session.query(self.meta.model).filter(
+            pk.in_(collection.with_entities(pk).subquery()))
+
+    @classmethod
+    def get_indexes(cls, table):
+        """Load indexes (including the primary key and unique constraints) from the database."""
+        session = cls.meta.session
+        if session is None:
+            return None
+
+        inspector = inspect(session.get_bind())
+        indexes = [(tuple(inspector.get_pk_constraint(table)['constrained_columns']), True)]
+        indexes += [(tuple(index['column_names']), bool(index['unique']))
+                    for index in inspector.get_indexes(table)]
+        indexes += [(tuple(constraint['column_names']), True)
+                    for constraint in inspector.get_unique_constraints(table)]
+        return [(columns, unique) for columns, unique in indexes if columns]
+
+    @classmethod
+    def get_column(cls, field):
+        """Get (table, column) for the given filter or sorting."""
+        if isinstance(field, VanilaFilter):
+            field = field.mfield if field.mfield is not None else field.name
+
+        if isinstance(field, string_types):
+            field = getattr(cls.meta.model, field, None)
+
+        columns = getattr(getattr(field, 'property', None), 'columns', None)
+        if not columns or not hasattr(columns[0], 'table'):
+            return None
+        return columns[0].table.name, columns[0].name
+
+    def stream(self, collection):
+        """Use server-side cursors to stream the collection."""
+        return collection.execution_options(stream_results=True).yield_per(self.meta.batch_size)
 
     def paginate(self, offset=0, limit=None):
         """Paginate queryset."""
         cqs = self.collection.with_entities(func.count()).order_by(None)
-        return self.collection.offset(offset).limit(limit), self.meta.session.execute(cqs).scalar()
+        return self.collection.offset(offset).limit(limit), self.session.execute(cqs).scalar()
+
+
+def make_row_schema(Schema, model):
+    """Build a schema for rows and the columns to query from the given model schema.
+
+    Many-to-one relationships are loaded as foreign keys. Return (None, None) if the schema
+    has fields which are not columns.
+    """
+    mapper = inspect(model)
+    schema = Schema()
+    fields, columns = {}, []
+    for name, field in schema.fields.items():
+        if field.load_only:
+            continue
+
+        attr = field.attribute or name
+        if attr in mapper.column_attrs:
+            field = copy.deepcopy(field)
+            column = getattr(model, attr)
+
+        elif attr in mapper.relationships:
+            prop = mapper.relationships[attr]
+            if prop.direction is not MANYTOONE or len(prop.local_columns) != 1:
+                return None, None
+            field = ma.fields.Raw(dump_to=field.dump_to)
+            column, = prop.local_columns
+
+        else:
+            return None, None
+
+        field.attribute = None
+        fields[name] = field
+        columns.append(column.label(name))
+
+    meta = type('Meta', (object,), {'ordered': schema.opts.ordered})
+    return type(Schema.__name__ + 'Rows', (ma.Schema,), dict(fields, Meta=meta)), columns
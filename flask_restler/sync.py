@@ -0,0 +1,76 @@
+"""Support incremental sync: `since` param, sync tokens and tombstones."""
+
+from __future__ import absolute_import
+
+import base64
+import datetime as dt
+import threading
+
+from flask._compat import text_type
+
+from .fields import datetime_to_timestamp
+
+
+TOMBSTONES_SIZE = 100000
+
+
+class Tombstones(object):
+
+    """Keep deleted resources in memory (per process).
+
+    Subclass it to share tombstones between processes (Redis, a database table and etc)::
+
+        class Meta:
+            updated_field = 'updated'
+            tombstones = Tombstones()
+
+    """
+
+    def __init__(self, size=TOMBSTONES_SIZE):
+        """Initialize the store.
+
+        :param size: Max tombstones to keep (the oldest ones are dropped)
+        """
+        self.size = size
+        self.tombstones = []
+        self.horizon = None
+        self.lock = threading.Lock()
+
+    def add(self, name, tombstone, time):
+        """Remember a deleted resource."""
+        with self.lock:
+            self.tombstones.append((time, name, tombstone))
+            if len(self.tombstones) > self.size:
+                self.horizon = self.tombstones[-self.size - 1][0]
+                self.tombstones = self.tombstones[-self.size:]
+
+    def since(self, name, time):
+        """Get resources deleted at the time or later. Return None when they are forgotten."""
+        if self.horizon is not None and time <= self.horizon:
+            return None
+        return [tombstone for (time_, name_, tombstone) in self.tombstones
+                if name_ == name and time_ >= time]
+
+
+def make_token(time):
+    """Make an opaque sync token for the given time."""
+    token = base64.urlsafe_b64encode(('%.6f' % datetime_to_timestamp(time)).encode('ascii'))
+    return token.decode('ascii').rstrip('=')
+
+
+def parse_since(value):
+    """Parse a unix timestamp or a sync token. Raise ValueError for invalid values."""
+    try:
+        timestamp = float(value)
+    except ValueError:
+        value = text_type(value)
+        try:
+            token = base64.urlsafe_b64decode((value + '=' * (-len(value) % 4)).encode('ascii'))
+            timestamp = float(token.decode('ascii', 'replace'))
+        except (TypeError, UnicodeEncodeError):
+            raise ValueError('Invalid sync token: %r' % value)
+
+    try:
+        return dt.datetime.utcfromtimestamp(timestamp)
+    except (OverflowError, OSError):
+        raise ValueError('Invalid timestamp: %r' % value)
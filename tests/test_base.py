@@ -1,3 +1,5 @@
+import json
+
 import pytest
 
 
@@ -140,7 +142,7 @@ def test_resource2(api, client):
     assert response.status_code == 400
     assert response.json['error']
     assert SecondResource.meta.strict == set(
-        ['where', 'sort', 'page', 'per_page'])
+        ['where', 'sort', 'page', 'per_page', 'fields'])
 
 
 def test_pagination(api, client):
@@ -180,3 +182,632 @@ def test_specs(api, client):
 
     response = client.get('/api/v1/_specs')
     assert response.json
+
+
+def test_register_many(app, api, client):
+    from flask_restler import Resource
+
+    for num in range(500):
+        api.route('/res%d' % num)(type('Res%dResource' % num, (Resource,), {}))
+
+    rules = [rule for rule in app.url_map.iter_rules() if rule.rule.startswith('/api/v1/res')]
+    assert len(rules) == 1000
+
+    response = client.get('/api/v1/res499')
+    assert response.status_code == 200
+
+
+def test_lazy_collection(api, client):
+    from flask_restler import Resource
+
+    @api.route
+    class LazyResource(Resource):
+
+        methods = 'get', 'post'
+
+        def get_many(self, **kwargs):
+            raise AssertionError('The collection should not be loaded.')
+
+        def post(self, **kwargs):
+            return 'created'
+
+    response = client.post('/api/v1/lazy')
+    assert response.json == 'created'
+
+
+def test_serializers(app, client):
+    msgpack = pytest.importorskip('msgpack')
+    cbor2 = pytest.importorskip('cbor2')
+
+    from flask_restler import Api, Resource
+    from flask_restler.serializers import MsgPackSerializer, CBORSerializer
+
+    api = Api('Formats', __name__, url_prefix='/formats',
+              serializers=[MsgPackSerializer(), CBORSerializer()])
+    api.register(app)
+
+    DATA = [{'name': 'mike'}]
+
+    @api.route
+    class FormatResource(Resource):
+
+        methods = 'get', 'post'
+
+        def get_many(self, **kwargs):
+            return DATA
+
+        def post(self, **kwargs):
+            DATA.append(self.get_data())
+            return DATA[-1]
+
+    response = client.get('/formats/format')
+    assert response.mimetype == 'application/json'
+    assert response.json == DATA
+
+    response = client.get('/formats/format', headers={'Accept': 'application/msgpack'})
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.data, raw=False) == DATA
+
+    response = client.post(
+        '/formats/format', data=cbor2.dumps({'name': 'dave'}),
+        headers={'Accept': 'application/cbor', 'Content-Type': 'application/cbor'})
+    assert response.mimetype == 'application/cbor'
+    assert cbor2.loads(response.data) == {'name': 'dave'}
+
+    response = client.get('/formats/format', headers={'Accept': 'text/html'})
+    assert response.mimetype == 'application/json'
+
+    response = client.get('/formats/_specs')
+    assert 'application/cbor' in response.json['produces']
+
+
+def test_ndjson(app, api):
+    from flask_restler import Resource
+
+    DATA = list(range(250))
+
+    @api.route
+    class StreamResource(Resource):
+
+        class Meta:
+            per_page = 10
+            filters = 'num',
+
+        def get_many(self, **kwargs):
+            return DATA
+
+    client = app.test_client()
+    headers = {'Accept': 'application/x-ndjson'}
+
+    response = client.get('/api/v1/stream', headers=headers)
+    assert response.mimetype == 'application/x-ndjson'
+    assert response.is_streamed
+    assert 'X-Total-Count' not in response.headers
+    assert [int(line) for line in response.data.splitlines()] == DATA
+
+    response = client.get('/api/v1/stream?where={"num": {"$lt": 5}}', headers=headers)
+    assert response.data == b'0\n1\n2\n3\n4\n'
+
+    @api.route
+    class RestrictedResource(Resource):
+
+        def get_many(self, **kwargs):
+            return DATA
+
+        def get(self, resource=None, **kwargs):
+            return self.collection[:2]
+
+    response = client.get('/api/v1/restricted', headers=headers)
+    assert response.data == b'0\n1\n'
+
+    @api.route('/func')
+    def func(*args, **kwargs):
+        return {'ok': True}
+
+    response = client.get('/api/v1/func', headers=headers)
+    assert response.data == b'{"ok": true}\n'
+
+    response = client.get('/api/v1/_specs', headers=headers)
+    assert response.data
+
+    @api.route
+    class HiddenResource(Resource):
+
+        class Meta:
+            batch_size = 2
+
+        def get_many(self, **kwargs):
+            return [{'num': num, 'secret': 'secret'} for num in range(5)]
+
+        def to_simple(self, data, many=False, **kwargs):
+            data = super(HiddenResource, self).to_simple(data, many=many, **kwargs)
+            return [{'num': row['num']} for row in data] if many else data
+
+    response = client.get('/api/v1/hidden', headers=headers)
+    assert response.data.decode().splitlines() == ['{"num": %d}' % num for num in range(5)]
+
+
+def test_csv(app, api):
+    import marshmallow as ma
+    from flask_restler import Resource
+
+    DATA = [{'id': num, 'name': 'user%d' % num, 'tags': ['a', 'b']} for num in range(250)]
+
+    @api.route
+    class UserResource(Resource):
+
+        class Meta:
+            per_page = 10
+
+        class Schema(ma.Schema):
+
+            class Meta:
+                ordered = True
+
+            id = ma.fields.Integer()
+            name = ma.fields.String()
+            tags = ma.fields.List(ma.fields.String())
+
+        def get_many(self, **kwargs):
+            return DATA
+
+    client = app.test_client()
+    headers = {'Accept': 'text/csv'}
+
+    response = client.get('/api/v1/user', headers=headers)
+    assert response.mimetype == 'text/csv'
+    lines = response.data.decode().splitlines()
+    assert len(lines) == 251
+    assert lines[0] == 'id,name,tags'
+    assert lines[1] == '0,user0,"[""a"", ""b""]"'
+
+    response = client.get('/api/v1/user?fields=name,id,unknown', headers=headers)
+    lines = response.data.decode().splitlines()
+    assert lines[:3] == ['name,id', 'user0,0', 'user1,1']
+
+    # Wildcards don't select CSV
+    response = client.get('/api/v1/user', headers={'Accept': 'text/*'})
+    assert response.mimetype == 'application/json'
+
+    response = client.get('/api/v1/user', headers={'Accept': '*/*'})
+    assert response.mimetype == 'application/json'
+
+    response = client.get('/api/v1/_specs')
+    assert 'text/csv' in response.json['produces']
+    assert 'text/csv' not in response.json['consumes']
+
+    DATA[0]['name'] = '=HYPERLINK("http://evil")'
+    DATA[1]['name'] = '-1+2'
+    DATA[2]['id'] = -2
+    DATA[3]['name'] = u'\u041c\u0430\u0448\u0430'
+    response = client.get('/api/v1/user?fields=id,name', headers=headers)
+    lines = response.data.decode('utf-8').splitlines()
+    assert lines[1:5] == [u'0,"\'=HYPERLINK(""http://evil"")"', u"1,'-1+2", u'-2,user2',
+                          u'3,\u041c\u0430\u0448\u0430']
+
+
+def test_compress(app):
+    import zlib
+    from flask_restler import Api, Resource
+
+    api = Api('Compress', __name__, url_prefix='/compress', compress=True)
+    app.register_blueprint(api)
+
+    DATA = list(range(1000))
+
+    @api.route
+    class NumResource(Resource):
+
+        class Meta:
+            per_page = None
+
+        def get_many(self, **kwargs):
+            return DATA
+
+        def get(self, resource=None, **kwargs):
+            if resource:
+                return int(resource)
+            return super(NumResource, self).get(**kwargs)
+
+    client = app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+
+    response = client.get('/compress/num')
+    assert 'Content-Encoding' not in response.headers
+    assert response.headers['Vary'] == 'Accept-Encoding'
+
+    response = client.get('/compress/num', headers=headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(zlib.decompress(response.data, 16 + zlib.MAX_WBITS).decode('utf-8')) == DATA
+
+    response = client.get('/compress/num/1', headers=headers)
+    assert 'Content-Encoding' not in response.headers
+    assert response.json == 1
+
+    response = client.get('/compress/num', headers=dict(headers, Accept='application/x-ndjson'))
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert zlib.decompress(response.data, 16 + zlib.MAX_WBITS).splitlines()[-1] == b'999'
+
+    response = client.get('/compress/_specs', headers=headers)
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert ('/compress/_specs', 'gzip') in api.compressed
+
+
+def test_concurrency(app, api, client):
+    import threading
+    from flask_restler import Resource
+
+    started, done = threading.Event(), threading.Event()
+
+    @api.route
+    class SlowResource(Resource):
+
+        class Meta:
+            concurrency = 1
+            concurrency_timeout = 0.01
+
+        def get(self, resource=None, **kwargs):
+            if resource == 'slow':
+                started.set()
+                done.wait()
+            return 'OK'
+
+    thread = threading.Thread(target=lambda: app.test_client().get('/api/v1/slow/slow'))
+    thread.start()
+    started.wait()
+
+    response = client.get('/api/v1/slow')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    done.set()
+    thread.join()
+
+    response = client.get('/api/v1/slow')
+    assert response.json == 'OK'
+
+    stats = SlowResource.meta.limit.stats
+    assert stats['accepted'] == 2
+    assert stats['rejected'] == 1
+    assert stats['active'] == 0
+    assert stats['waiting'] == 0
+
+    @api.route
+    class ExportResource(Resource):
+
+        class Meta:
+            concurrency = 1
+            concurrency_timeout = 0.01
+
+        def get_many(self, **kwargs):
+            return list(range(10))
+
+    # Run in a thread to keep the streamed request context apart from the test's one
+    def export():
+        stream = app.test_client().get(
+            '/api/v1/export', headers={'Accept': 'application/x-ndjson'}, buffered=False)
+        results.append(ExportResource.meta.limit.stats['active'])
+        results.append(b''.join(stream.response))
+        stream.close()
+        results.append(ExportResource.meta.limit.stats['active'])
+
+    results = []
+    thread = threading.Thread(target=export)
+    thread.start()
+    thread.join()
+    assert results == [1, ''.join('%d\n' % num for num in range(10)).encode('ascii'), 0]
+
+
+def test_coalesce(app, api, client):
+    import threading
+    import time
+    from flask_restler import Resource
+
+    started, done = threading.Event(), threading.Event()
+    calls = []
+
+    @api.route
+    class ReportResource(Resource):
+
+        class Meta:
+            coalesce = True
+
+        def get(self, resource=None, **kwargs):
+            calls.append(1)
+            started.set()
+            done.wait()
+            return {'calls': len(calls)}
+
+    responses = []
+
+    def request():
+        responses.append(app.test_client().get('/api/v1/report?a=1&b=2'))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait()
+
+    followers = [threading.Thread(target=request) for _ in range(3)]
+    for thread in followers:
+        thread.start()
+
+    time.sleep(0.2)
+    done.set()
+    for thread in [leader] + followers:
+        thread.join()
+
+    assert len(calls) == 1
+    assert [r.json for r in responses] == [{'calls': 1}] * 4
+    assert ReportResource.meta.flights.stats['leaders'] == 1
+
+    response = client.get('/api/v1/report?b=2&a=1')
+    assert response.json == {'calls': 2}
+
+    with app.test_request_context('/api/v1/report', headers={'Authorization': 'mike'}):
+        mike = ReportResource(api).get_coalesce_key()
+    with app.test_request_context('/api/v1/report', headers={'Authorization': 'bob'}):
+        bob = ReportResource(api).get_coalesce_key()
+    with app.test_request_context('/api/v1/report', headers={'Cookie': 'session=bob'}):
+        cookie = ReportResource(api).get_coalesce_key()
+    assert len({mike, bob, cookie}) == 3
+
+
+def test_batch(app):
+    from flask import request, url_for
+    from flask_restler import Api, Resource, APIError
+
+    api = Api('batch', __name__, url_prefix='/api/v1', batch=True, batch_limit=5,
+              batch_workers=2)
+    api.register(app)
+
+    data = {1: {'name': 'Mike'}, 2: {'name': 'Bob'}}
+
+    @api.route
+    class UserResource(Resource):
+
+        methods = 'get', 'post'
+
+        class Meta:
+            name = 'user'
+
+        def authorize(self, *args, **kwargs):
+            if request.headers.get('Authorization') != 'token':
+                raise APIError('Forbidden', 403)
+
+        def get_one(self, user=None, **kwargs):
+            if user is None:
+                return None
+            if int(user) not in data:
+                raise APIError('Not found', 404)
+            return data[int(user)]
+
+        def get_many(self, *args, **kwargs):
+            return list(data.values())
+
+        def post(self, *args, **kwargs):
+            return dict(request.json, created=True)
+
+        def get(self, resource=None, **kwargs):
+            if resource is None:
+                return self.collection[:int(request.args.get('limit', 10))]
+            return resource
+
+    calls = [
+        {'path': '/api/v1/user/1'},
+        {'path': '/api/v1/user?limit=1'},
+        {'path': '/api/v1/user', 'args': {'limit': 2}},
+        {'method': 'POST', 'path': '/api/v1/user', 'body': {'name': 'Tom'}},
+        {'path': '/api/v1/user/3'},
+    ]
+    client = app.test_client()
+    response = client.post('/api/v1/_batch', data=json.dumps(calls),
+                           content_type='application/json', headers={'Authorization': 'token'})
+    assert response.status_code == 200
+    assert [dict(result, headers=None) for result in response.json] == [
+        dict(result, headers=None) for result in [
+            {'status': 200, 'body': {'name': 'Mike'}},
+            {'status': 200, 'body': [{'name': 'Mike'}]},
+            {'status': 200, 'body': [{'name': 'Mike'}, {'name': 'Bob'}]},
+            {'status': 200, 'body': {'name': 'Tom', 'created': True}},
+            {'status': 404, 'body': {'error': 'Not found', 'code': 404}}]]
+
+    response = client.post('/api/v1/_batch', data=json.dumps(calls[:1]),
+                           content_type='application/json')
+    assert response.json == [
+        {'status': 403, 'headers': {}, 'body': {'error': 'Forbidden', 'code': 403}}]
+
+    response = client.post('/api/v1/_batch', data=json.dumps([
+        {'path': '/'}, {'path': '/api/v1/_batch', 'method': 'POST'},
+        {'path': '/api/v1/user/1', 'method': 'DELETE'}]), content_type='application/json')
+    assert [r['status'] for r in response.json] == [404, 404, 405]
+
+    response = client.post('/api/v1/_batch', data=json.dumps(calls * 2),
+                           content_type='application/json')
+    assert response.status_code == 413
+
+    @api.route
+    class PageResource(Resource):
+
+        class Meta:
+            per_page = 1
+
+        def get_many(self, *args, **kwargs):
+            return [url_for('.page', page=1)]
+
+        def get_one(self, page=None, **kwargs):
+            if page == 'fail':
+                raise ValueError('Fail')
+            return page
+
+    response = client.post('/api/v1/_batch', data=json.dumps([
+        {'path': '/api/v1/page'}, {'path': '/api/v1/page/fail'},
+        {'path': '/api/v1/page', 'args': ['x']}, {'path': '/api/v1/_specs'}]),
+        content_type='application/json')
+    assert response.status_code == 200
+    assert [r['status'] for r in response.json] == [200, 500, 400, 404]
+    assert response.json[0]['body'] == ['/api/v1/page/1']
+    assert response.json[0]['headers']['X-Total-Count'] == '1'
+
+
+def test_sync(app, api, client):
+    import datetime as dt
+    from flask_restler import Resource
+    from flask_restler.sync import Tombstones, make_token, parse_since
+
+    now = dt.datetime(2018, 12, 20, 10, 30)
+    assert parse_since(make_token(now)) == now
+    assert parse_since('1545301800') == now
+    for value in ('invalid', 'inf', 'nan', '1e20', '-1e20'):
+        with pytest.raises(ValueError):
+            parse_since(value)
+
+    USERS = [
+        {'id': 1, 'name': 'Mike', 'updated': now - dt.timedelta(days=1)},
+        {'id': 2, 'name': 'Bob', 'updated': now},
+        {'id': 3, 'name': 'Tom', 'updated': now + dt.timedelta(days=1)},
+    ]
+
+    @api.route
+    class UserResource(Resource):
+
+        methods = 'get', 'delete'
+
+        class Meta:
+            updated_field = 'updated'
+            tombstones = Tombstones(size=2)
+            per_page = 1
+            strict = True
+
+        def get_many(self, *args, **kwargs):
+            return USERS
+
+        def get_one(self, *args, **kwargs):
+            return next((user for user in USERS if str(user['id']) == kwargs.get('user')), None)
+
+        def get_tombstone(self, resource):
+            return {'id': resource['id']}
+
+        def to_simple(self, data, many=False, **kwargs):
+            if many:
+                return [{'id': user['id']} for user in data]
+            return data
+
+    response = client.get('/api/v1/user?since=1545301800')
+    assert response.json == [{'id': 2}]
+    assert response.headers['X-Total-Count'] == '2'
+    token = response.headers['X-Sync-Token']
+    assert parse_since(token) > now
+
+    response = client.get('/api/v1/user?since=%s' % token)
+    assert response.json == []
+
+    response = client.delete('/api/v1/user/2')
+    assert response.status_code == 200
+
+    response = client.get('/api/v1/user?since=%s' % token)
+    assert response.json == [{'id': 2, '_deleted': True}]
+
+    response = client.get('/api/v1/user?since=%s&page=1' % token)
+    assert response.json == []
+
+    # Streamed changes include deleted resources too
+    response = app.test_client().get(
+        '/api/v1/user?since=%s' % token, headers={'Accept': 'application/x-ndjson'})
+    assert response.data.decode().splitlines() == ['{"_deleted": true, "id": 2}']
+    assert response.headers['X-Sync-Token']
+
+    response = app.test_client().get(
+        '/api/v1/user?since=%s' % token, headers={'Accept': 'text/csv'})
+    assert response.data.decode().splitlines() == ['_deleted,id', 'True,2']
+
+    response = client.get('/api/v1/user?since=invalid')
+    assert response.status_code == 400
+
+    response = client.get('/api/v1/user?since=1e20')
+    assert response.status_code == 400
+
+    client.delete('/api/v1/user/1')
+    client.delete('/api/v1/user/3')
+    response = client.get('/api/v1/user?since=%s' % token)
+    assert response.status_code == 410
+
+
+def test_bulk(app, api, client):
+    from flask_restler import Resource
+    from flask_restler.filters import Filter
+
+    class KeyFilter(Filter):
+
+        def apply(self, collection, ops, **kwargs):
+            return [obj for obj in collection if all(op(obj[self.name], val) for op, val in ops)]
+
+    USERS = [{'name': name, 'role': 'user'} for name in ('Mike', 'Bob', 'Tom')]
+
+    @api.route
+    class UserResource(Resource):
+
+        methods = 'get', 'patch', 'delete'
+
+        class Meta:
+            filters = KeyFilter('role'), KeyFilter('name')
+            bulk = True
+            bulk_limit = 2
+
+        def get_many(self, *args, **kwargs):
+            return USERS
+
+    response = client.delete('/api/v1/user')
+    assert response.status_code == 400
+
+    response = client.delete('/api/v1/user?where={"unknown": 1}')
+    assert response.status_code == 400
+
+    response = client.delete('/api/v1/user?where={"role": "user"}')
+    assert response.status_code == 400
+    assert len(USERS) == 3
+
+    response = client.delete('/api/v1/user?where={"name": {"$ne": "Tom"}}&dry_run=1')
+    assert response.json == {'count': 2, 'dry_run': True}
+    assert len(USERS) == 3
+
+    response = client.open('/api/v1/user?where={"name": "Tom"}', method='PATCH',
+                           data='{"role": "admin"}', content_type='application/json')
+    assert response.json == {'count': 1}
+    assert USERS[2]['role'] == 'admin'
+
+    response = client.delete('/api/v1/user?where={"role": "user"}')
+    assert response.json == {'count': 2}
+    assert USERS == [{'name': 'Tom', 'role': 'admin'}]
+
+
+def test_aggregations(app, api, client):
+    from flask_restler import Resource
+
+    @api.route
+    class OrderResource(Resource):
+
+        class Meta:
+            aggregations = 'status', 'amount'
+            strict = True
+
+        def get_many(self, *args, **kwargs):
+            return [
+                {'status': 'new', 'amount': 10},
+                {'status': 'paid', 'amount': 20},
+                {'status': 'new', 'amount': 30},
+                {'status': 'new', 'amount': None},
+            ]
+
+    response = client.get('/api/v1/order?agg=count,sum:amount')
+    assert response.json == [{'count': 4, 'sum_amount': 60}]
+
+    response = client.get('/api/v1/order?group_by=status&agg=count,avg:amount,max:amount')
+    assert response.json == [
+        {'status': 'new', 'count': 3, 'avg_amount': 20.0, 'max_amount': 30},
+        {'status': 'paid', 'count': 1, 'avg_amount': 20.0, 'max_amount': 20},
+    ]
+
+    for query in ('group_by=unknown', 'agg=sum:unknown', 'agg=count:amount', 'agg=sum',
+                  'agg=median:amount'):
+        response = client.get('/api/v1/order?' + query)
+        assert response.status_code == 400, query
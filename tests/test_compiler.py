@@ -0,0 +1,139 @@
+import datetime as dt
+from collections import OrderedDict
+
+import bson
+import marshmallow as ma
+import pytest
+
+from flask_restler.compiler import compile_schema
+from flask_restler.fields import Timestamp, MSTimestamp
+from flask_restler.mongo import ObjectId
+
+
+class Obj(object):
+
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+    def method(self):
+        return 'called'
+
+
+class Item(dict):
+    pass
+
+
+class Schema(ma.Schema):
+    id = ObjectId(attribute='_id')
+    name = ma.fields.String()
+    title = ma.fields.String(dump_to='label')
+    num = ma.fields.Integer()
+    num_str = ma.fields.Integer(as_string=True)
+    price = ma.fields.Float()
+    active = ma.fields.Boolean()
+    raw = ma.fields.Raw()
+    created = Timestamp()
+    updated = MSTimestamp()
+    status = ma.fields.String(default='new')
+    counter = ma.fields.Integer(default=lambda: 42)
+    secret = ma.fields.String(load_only=True)
+    method = ma.fields.String()
+    keys = ma.fields.Raw()
+    nested = ma.fields.Nested('NestedSchema')
+    city = ma.fields.String(attribute='address.city')
+    date = ma.fields.DateTime()
+    computed = ma.fields.Method('get_computed')
+
+    def get_computed(self, obj):
+        return 'computed'
+
+
+class NestedSchema(ma.Schema):
+    value = ma.fields.Integer()
+
+
+NOW = dt.datetime(2018, 12, 20, 10, 20, 30, 123000)
+ROWS = [
+    {},
+    {'_id': bson.ObjectId('5c1b6a8e6cc2490a5d6e4b1f'), 'name': 'Mike', 'title': 'Mr', 'num': 1,
+     'num_str': 2, 'price': 1.5, 'active': True, 'raw': {'any': [1]}, 'created': NOW,
+     'updated': NOW, 'status': 'old',
+     'counter': 1, 'secret': 'secret', 'method': 'value', 'keys': 3, 'nested': {'value': 1},
+     'address': {'city': 'Moscow'}, 'date': NOW},
+    {'_id': None, 'name': None, 'title': None, 'num': None, 'price': None, 'active': None,
+     'raw': None, 'created': None, 'updated': None, 'status': None, 'counter': None,
+     'nested': None, 'address': None, 'date': None},
+    {'name': b'bytes', 'num': '10', 'price': 2, 'active': 'false', 'num_str': 3.5},
+    {'num': True, 'price': '1.5', 'active': 1, 'name': 10},
+]
+
+
+@pytest.mark.parametrize('row', ROWS + [Item(row) for row in ROWS] + [Obj(**row) for row in ROWS])
+def test_dump(row):
+    dump = compile_schema(Schema)
+    schema = Schema()
+    assert dump(schema, row) == schema.dump(row).data
+    assert dump(schema, [row, row], many=True) == schema.dump([row, row], many=True).data
+    assert dump(schema, iter([row]), many=True) == schema.dump([row], many=True).data
+
+
+def test_errors():
+    dump = compile_schema(Schema)
+    schema = Schema()
+    rows = [{'num': 1}, {'num': 'invalid', 'price': 'invalid'}]
+    assert dump(schema, rows, many=True) == schema.dump(rows, many=True).data
+    assert dump(schema, rows[1]) == schema.dump(rows[1]).data
+
+
+def test_options():
+
+    class Ordered(ma.Schema):
+        b = ma.fields.Integer()
+        a = ma.fields.String()
+
+        class Meta:
+            ordered = True
+
+    dump = compile_schema(Ordered)
+    result = dump(Ordered(), {'a': 'a', 'b': 1})
+    assert isinstance(result, OrderedDict)
+    assert list(result) == ['b', 'a']
+
+    schema = Ordered(only=('a',))
+    assert dump(schema, {'a': 'a', 'b': 1}) == {'a': 'a'}
+
+    class Processed(ma.Schema):
+        a = ma.fields.String()
+
+        @ma.post_dump
+        def upper(self, data):
+            return {key: value.upper() for key, value in data.items()}
+
+    assert compile_schema(Processed) is None
+
+    class Inferred(ma.Schema):
+
+        class Meta:
+            fields = 'a', 'b'
+
+    assert compile_schema(Inferred) is None
+
+
+def test_resource(app, api, client):
+    from flask_restler import Resource
+
+    @api.route
+    class ItemResource(Resource):
+
+        Schema = Schema
+
+        class Meta:
+            compile_schema = True
+
+        def get_many(self, *args, **kwargs):
+            return [dict(row, keys=None) for row in ROWS]
+
+    assert ItemResource.meta.dumper
+
+    response = client.get('/api/v1/item')
+    assert response.json == Schema().dump(ItemResource().get_many(), many=True).data
@@ -1,3 +1,4 @@
+import json
 import peewee as pw
 import datetime as dt
 import marshmallow as ma
@@ -88,6 +89,11 @@ def test_resource(app, api, client):
     assert len(response.json) == 1
     assert response.json[0]['login'] == 'dave'
 
+    response = app.test_client().get(
+        '/api/v1/user?sort=login', headers={'Accept': 'application/x-ndjson'})
+    assert [json.loads(line)['login'] for line in response.data.splitlines()] == [
+        'dave', 'mike', 'zigmund']
+
     response = client.delete('/api/v1/user/1')
     assert not response.json
 
@@ -121,3 +127,336 @@ def test_custom_converter(app, api, client):
 
     response = client.get('/api/v1/user')
     assert response.json[0]['is_active'] is 1
+
+
+def test_read_replicas(app, api, client, tmpdir):
+    from flask_restler.peewee import ModelResource
+
+    primary = pw.SqliteDatabase(str(tmpdir.join('primary.db')))
+    replica = pw.SqliteDatabase(str(tmpdir.join('replica.db')))
+
+    class Item(pw.Model):
+
+        name = pw.CharField()
+
+        class Meta:
+            database = primary
+
+    for db in (primary, replica):
+        with Item.bind_ctx(db):
+            Item.create_table()
+
+    with Item.bind_ctx(replica):
+        Item.create(name='replica')
+
+    @api.route
+    class ItemResouce(ModelResource):
+
+        methods = 'get', 'post'
+
+        class Meta:
+            model = Item
+            read_database = replica
+
+    response = client.get('/api/v1/item')
+    assert [i['name'] for i in response.json] == ['replica']
+    assert response.headers['X-Total-Count'] == '1'
+
+    response = client.post_json('/api/v1/item', {'name': 'primary'})
+    assert response.json['name'] == 'primary'
+    assert Item.select().count() == 1
+
+    response = client.get('/api/v1/item')
+    assert [i['name'] for i in response.json] == ['replica']
+
+
+def test_pool(app, api, client, tmpdir):
+    import threading
+    from playhouse.pool import PooledSqliteDatabase
+    from flask_restler.peewee import ModelResource, pool_stats
+
+    db = PooledSqliteDatabase(str(tmpdir.join('pool.db')), max_connections=1)
+
+    class Item(pw.Model):
+
+        name = pw.CharField()
+
+        class Meta:
+            database = db
+
+    Item.create_table()
+    db.close()
+
+    @api.route
+    class ItemResouce(ModelResource):
+
+        methods = 'get', 'post'
+
+        class Meta:
+            model = Item
+            pool_timeout = 0.1
+
+    response = client.post_json('/api/v1/item', {'name': 'item'})
+    assert response.json['name'] == 'item'
+    assert pool_stats(db) == {
+        'in_use': 0, 'available': 1, 'max_connections': 1, 'saturation': 0}
+
+    connected, done = threading.Event(), threading.Event()
+
+    def hold():
+        db.connect()
+        connected.set()
+        done.wait()
+        db.close()
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    connected.wait()
+    assert pool_stats(db)['saturation'] == 1
+
+    response = client.get('/api/v1/item')
+    assert response.status_code == 503
+
+    done.set()
+    thread.join()
+
+    response = client.get('/api/v1/item')
+    assert response.json == [{'id': '1', 'name': 'item'}]
+    assert pool_stats(db)['in_use'] == 0
+
+
+def test_read_rows(app, api, client):
+    from flask_restler.peewee import ModelResource
+
+    role = Role.create(name='rows')
+    for num in range(5):
+        User.create(login='rows%d' % num, name=num % 2 and 'Rows %d' % num or None,
+                    role=num % 2 and role or None, is_active=bool(num % 3))
+
+    def make_resource(name, **options):
+        meta = type('Meta', (object,), dict(dict(
+            model=User, filters=('login',), sorting=('login',), schema_exclude=('password',),
+            name=name), **options))
+        return api.route(type(name.title() + 'Resource', (ModelResource,), {'Meta': meta}))
+
+    make_resource('models')
+    UserRowsResource = make_resource('rows', read_mode='rows', compile_schema=True)
+    assert UserRowsResource.meta.row_dumper
+    assert make_resource('plain', read_mode='rows').meta.row_dumper is None
+
+    query = '?where={"login": {"$starts": "rows"}}&sort=-login&per_page=3&page=1'
+    expected = client.get('/api/v1/models' + query).json
+    assert [user['login'] for user in expected] == ['rows1', 'rows0']
+    assert expected[0]['role'] == str(role.id)
+
+    response = client.get('/api/v1/rows' + query)
+    assert response.json == expected
+    assert response.headers['X-Total-Count'] == '5'
+
+    response = client.get('/api/v1/plain' + query)
+    assert response.json == expected
+
+    response = client.get('/api/v1/rows/%s' % expected[0]['id'])
+    assert response.json == expected[0]
+
+    RoleResource = make_resource('role', model=Role, read_mode='rows', schema={
+        'title': ma.fields.Function(lambda role: role.name.title())})
+    assert RoleResource.meta.read_mode == 'models'
+
+
+def test_check_indexes(app, api, client):
+    from flask_restler.peewee import ModelResource, Filter
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        class Meta:
+            model = User
+            filters = 'id', 'login', Filter('role', mfield=Role.name)
+            sorting = 'login', User.created
+
+    assert sorted(scan['message'] for scan in api.check_indexes()) == [
+        "user: filter 'login' scans table 'user' (no index on login)",
+        "user: filter 'role' scans table 'role' (no index on name)",
+        "user: sorting 'created' sorts table 'user' in memory (no index on created)",
+        "user: sorting 'login' sorts table 'user' in memory (no index on login)",
+    ]
+
+    database.execute_sql('CREATE INDEX user_login ON user (login)')
+    assert [scan['filter'] for scan in api.check_indexes()] == ['role', None]
+
+
+def test_search(app, api, client):
+    from playhouse.sqlite_ext import FTS5Model, SearchField
+    from flask_restler.peewee import ModelResource
+
+    class UserIndex(FTS5Model):
+
+        name = SearchField()
+
+        class Meta:
+            database = database
+
+    UserIndex.create_table()
+    for num, name in enumerate(('Mike Bacon', 'Bob Bacon', 'Mike Tyson')):
+        user = User.create(login='search%d' % num, name=name)
+        UserIndex.insert(rowid=user.id, name=name).execute()
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        class Meta:
+            model = User
+            filters = 'login',
+            search = UserIndex
+
+    response = client.get('/api/v1/user?q=bacon')
+    assert sorted(user['login'] for user in response.json) == ['search0', 'search1']
+
+    response = client.get('/api/v1/user?q=bacon&where={"login": "search1"}')
+    assert [user['login'] for user in response.json] == ['search1']
+
+    response = client.get('/api/v1/user?q=mike&per_page=1')
+    assert len(response.json) == 1
+    assert response.headers['X-Total-Count'] == '2'
+
+    class UserVectorResource(ModelResource):
+
+        class Meta:
+            model = User
+            search = 'name',
+
+    # Postgres full-text search accepts plain user input
+    collection = User.select(User.id).bind(pw.PostgresqlDatabase('test'))
+    sql, params = UserVectorResource(api).search(collection, 'mike bacon').sql()
+    assert '"name" @@ plainto_tsquery(%s)' in sql
+    assert params == ['mike bacon']
+
+
+def test_sync(app, api, client):
+    from flask_restler.peewee import ModelResource
+    from flask_restler.sync import Tombstones, make_token
+
+    past = dt.datetime.utcnow() - dt.timedelta(hours=1)
+    User.update(created=past).execute()
+    mike = User.create(login='sync-mike')
+    bob = User.create(login='sync-bob')
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'delete'
+
+        class Meta:
+            model = User
+            updated_field = 'created'
+            tombstones = Tombstones()
+
+    response = client.get('/api/v1/user?since=%s' % make_token(past + dt.timedelta(minutes=1)))
+    assert sorted(user['login'] for user in response.json) == ['sync-bob', 'sync-mike']
+    token = response.headers['X-Sync-Token']
+
+    client.delete('/api/v1/user/%s' % bob.id)
+    User.update(name='Mike', created=dt.datetime.utcnow()).where(User.id == mike.id).execute()
+
+    response = client.get('/api/v1/user?since=%s' % token)
+    assert [user.get('name') for user in response.json] == ['Mike', None]
+    assert response.json[1] == {'id': bob.id, '_deleted': True}
+
+
+def test_fast_patch(app, api, client):
+    from flask_restler.peewee import ModelResource
+
+    role = Role.create(name='patch')
+    user = User.create(login='patch', name='Patch')
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'patch'
+
+        class Meta:
+            model = User
+            fast_patch = True
+
+    response = client.open(
+        '/api/v1/user/%s' % user.id, method='PATCH', data=json.dumps({
+            'name': 'Mike', 'role': role.id}), content_type='application/json',
+        headers={'Prefer': 'return=minimal'})
+    assert response.status_code == 204
+    assert User.get_by_id(user.id).name == 'Mike'
+    assert User.get_by_id(user.id).role == role
+
+    response = client.open('/api/v1/user/%s' % user.id, method='PATCH', data='{"name": "Bob"}',
+                           content_type='application/json')
+    assert response.json['name'] == 'Bob'
+    assert response.json['login'] == 'patch'
+
+    response = client.open('/api/v1/user/0', method='PATCH', data='{"name": "Tom"}',
+                           content_type='application/json')
+    assert response.status_code == 404
+
+    response = client.open('/api/v1/user/%s' % user.id, method='PATCH',
+                           data='{"is_active": "invalid"}', content_type='application/json')
+    assert response.status_code == 400
+
+
+def test_bulk(app, api, client):
+    from flask_restler.peewee import ModelResource
+    from flask_restler.sync import Tombstones
+
+    role = Role.create(name='bulk')
+    for num in range(3):
+        User.create(login='bulk%d' % num, name='Bulk', role=num and role or None)
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'patch', 'delete'
+
+        class Meta:
+            model = User
+            filters = 'name', 'role', 'unknown'
+            bulk = True
+            tombstones = Tombstones()
+
+    response = client.delete('/api/v1/user?where={"unknown": "x"}')
+    assert response.status_code == 400
+    assert User.select().where(User.name == 'Bulk').count() == 3
+
+    response = client.open('/api/v1/user?where={"name": "Bulk"}', method='PATCH',
+                           data='{"is_active": false}', content_type='application/json')
+    assert response.json == {'count': 3}
+    assert User.select().where(User.name == 'Bulk', User.is_active).count() == 0
+
+    response = client.delete('/api/v1/user?where={"role": %d}&dry_run=1' % role.id)
+    assert response.json == {'count': 2, 'dry_run': True}
+
+    ids = sorted(user.id for user in User.select().where(User.role == role))
+    response = client.delete('/api/v1/user?where={"role": %d}' % role.id)
+    assert response.json == {'count': 2}
+    tombstones = UserResouce.meta.tombstones.since('user', dt.datetime.min)
+    assert sorted(tombstone['id'] for tombstone in tombstones) == ids
+    assert [user.login for user in User.select().where(User.name == 'Bulk')] == ['bulk0']
+
+
+def test_aggregations(app, api, client):
+    from flask_restler.peewee import ModelResource
+
+    for num in range(5):
+        User.create(login='agg%d' % num, name='Aggregate', is_active=bool(num % 2))
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        class Meta:
+            model = User
+            filters = 'name',
+            aggregations = 'is_active', User.login
+
+    response = client.get(
+        '/api/v1/user?where={"name": "Aggregate"}&group_by=is_active&agg=count,min:login')
+    assert response.json == [
+        {'is_active': False, 'count': 3, 'min_login': 'agg0'},
+        {'is_active': True, 'count': 2, 'min_login': 'agg1'},
+    ]
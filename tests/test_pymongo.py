@@ -1,7 +1,8 @@
+import marshmallow as ma
 from marshmallow import fields
 from mongomock import MongoClient
 
-from flask_restler.mongo import MongoResource
+from flask_restler.mongo import MongoResource, ObjectId
 
 
 DB = MongoClient().db
@@ -65,6 +66,10 @@ def test_resource(app, api, client):
     response = client.get('/api/v1/user?where={"login": "dave"}')
     assert len(response.json) == 1
 
+    response = app.test_client().get(
+        '/api/v1/user?sort=login', headers={'Accept': 'application/x-ndjson'})
+    assert len(response.data.splitlines()) == 2
+
     response = client.delete('/api/v1/user/%s' % _id)
     assert not response.json
 
@@ -89,3 +94,318 @@ def test_resource(app, api, client):
     response = client.get('/api/v1/users?sort=name')
     assert response.status_code == 200
     assert UserGroupResouce.meta.aggregate == [{'$group': {'_id': '$login'}}]
+
+    response = app.test_client().get(
+        '/api/v1/users', headers={'Accept': 'application/x-ndjson'})
+    assert response.data == b'{"_id": "dave"}\n'
+
+
+def test_read_preference(app, api, client):
+    from pymongo import ReadPreference
+    from flask_restler.mongo import MongoChain
+
+    @api.route
+    class LogResource(MongoResource):
+
+        class Meta:
+            collection = DB.log
+            read_preference = {'get': 'primary'}
+            batch_size = 10
+
+    assert LogResource.meta.read_preference == {'GET': ReadPreference.PRIMARY}
+
+    DB.log.insert_many([{'num': num} for num in range(20)])
+    response = client.get('/api/v1/log?per_page=5')
+    assert len(response.json) == 5
+    assert response.headers['X-Total-Count'] == '20'
+
+    class Collection(object):
+
+        def with_options(self, **options):
+            self.options = options
+            return self
+
+    chain = MongoChain(
+        Collection(), read_preference=ReadPreference.SECONDARY_PREFERRED, max_time_ms=100)
+    assert chain.collection.options == {'read_preference': ReadPreference.SECONDARY_PREFERRED}
+    assert chain.cursor_options == {'max_time_ms': 100, 'batch_size': None}
+
+
+def test_embed(app, api, client):
+    import bson
+
+    authors = DB.embed_author.insert_many([{'name': 'Mike'}, {'name': 'Bob'}]).inserted_ids
+    tags = DB.embed_tag.insert_many([{'name': 'news'}, {'name': 'tech'}]).inserted_ids
+    DB.embed_post.insert_many([
+        {'title': 'First', 'author': authors[0], 'tags': tags},
+        {'title': 'Second', 'author': authors[0], 'tags': [tags[1]]},
+        {'title': 'Third', 'author': authors[1], 'tags': []},
+    ])
+
+    class TagSchema(ma.Schema):
+        name = fields.String()
+
+    queries = []
+
+    def tags_collection():
+        queries.append(1)
+        return DB.embed_tag
+
+    @api.route
+    class PostResource(MongoResource):
+
+        class Meta:
+            collection = DB.embed_post
+            name = 'post'
+            sorting = 'title',
+            strict = True
+            schema = {
+                'title': fields.String(),
+                'author': ObjectId(),
+            }
+            embed = {
+                'author': DB.embed_author,
+                'tags': {'collection': tags_collection, 'schema': TagSchema},
+            }
+
+    response = client.get('/api/v1/post?sort=title')
+    assert response.json[0]['author'] == str(authors[0])
+    assert 'tags' not in response.json[0]
+
+    response = client.get('/api/v1/post?sort=title&embed=author,tags')
+    assert response.json == [
+        {'_id': response.json[0]['_id'], 'title': 'First',
+         'author': {'_id': str(authors[0]), 'name': 'Mike'},
+         'tags': [{'name': 'news'}, {'name': 'tech'}]},
+        {'_id': response.json[1]['_id'], 'title': 'Second',
+         'author': {'_id': str(authors[0]), 'name': 'Mike'},
+         'tags': [{'name': 'tech'}]},
+        {'_id': response.json[2]['_id'], 'title': 'Third',
+         'author': {'_id': str(authors[1]), 'name': 'Bob'},
+         'tags': []},
+    ]
+    assert len(queries) == 1
+
+    _id = response.json[1]['_id']
+    response = client.get('/api/v1/post/%s?embed=tags' % _id)
+    assert response.json['tags'] == [{'name': 'tech'}]
+
+    response = client.get('/api/v1/post?embed=comments')
+    assert response.status_code == 400
+
+    PostResource.meta.embed_lookup = True
+    response = client.get('/api/v1/post?sort=-title&per_page=2&embed=author,tags')
+    assert [post['title'] for post in response.json] == ['Third', 'Second']
+    assert response.json[0]['author'] == {'_id': str(authors[1]), 'name': 'Bob'}
+    assert response.json[1]['tags'] == [{'name': 'tech'}]
+    assert response.headers['X-Total-Count'] == '3'
+    assert bson.ObjectId(response.json[0]['_id'])
+
+
+def test_passthrough(app, api, client):
+    import datetime as dt
+
+    created = dt.datetime(2018, 12, 20, 10, 30)
+    DB.passthrough.insert_many([
+        {'login': 'mike', 'created': created, 'password': 'secret', 'role': None},
+        {'login': 'bob', 'created': created, 'password': 'secret'},
+    ])
+
+    @api.route
+    class UserResource(MongoResource):
+
+        class Meta:
+            collection = DB.passthrough
+            name = 'passthrough'
+            sorting = 'login',
+            per_page = 1
+            passthrough = True
+            schema = {
+                'login': fields.String(),
+                'created': fields.DateTime(),
+                'role': ObjectId(),
+            }
+
+    assert set(UserResource.meta.passthrough) == {
+        ('_id', '_id'), ('login', 'login'), ('created', 'created'), ('role', 'role')}
+
+    response = client.get('/api/v1/passthrough?sort=login&page=1')
+    _id = response.json[0]['_id']
+    assert response.json == [
+        {'_id': _id, 'login': 'mike', 'created': '2018-12-20T10:30:00', 'role': None}]
+    assert response.headers['X-Total-Count'] == '2'
+
+    response = client.get('/api/v1/passthrough/%s' % _id)
+    assert response.json == {
+        '_id': _id, 'login': 'mike', 'created': '2018-12-20T10:30:00', 'role': None}
+
+    assert api.call(UserResource, args={'sort': '-login', 'per_page': 2}) == [
+        {'_id': _id, 'login': 'mike', 'created': created, 'role': None},
+        {'_id': api.call(UserResource, args={'sort': 'login'})[0]['_id'],
+         'login': 'bob', 'created': created},
+    ]
+
+    DB.renamed.insert_one({'full_name': 'Mike', 'login': 'mike'})
+
+    @api.route
+    class RenamedResource(MongoResource):
+
+        class Meta:
+            collection = DB.renamed
+            name = 'renamed'
+            passthrough = True
+            schema = {
+                'name': fields.String(attribute='full_name'),
+                'login': fields.String(dump_to='user'),
+            }
+
+    response = client.get('/api/v1/renamed')
+    assert response.json == [{'_id': response.json[0]['_id'], 'name': 'Mike', 'user': 'mike'}]
+
+
+def test_check_indexes(app, api, client):
+
+    @api.route
+    class LogResource(MongoResource):
+
+        class Meta:
+            collection = DB.indexed
+            filters = '_id', 'level', 'source'
+            sorting = 'created', 'level'
+
+    DB.indexed.create_index('source')
+    DB.indexed.create_index([('level', 1), ('created', -1)])
+
+    assert sorted(scan['message'] for scan in api.check_indexes()) == [
+        "indexed: filter 'source' with sorting 'level' sorts in memory "
+        "(no index on source, level)",
+        "indexed: sorting 'created' sorts table 'indexed' in memory (no index on created)",
+    ]
+
+    DB.indexed.create_index('created')
+    assert sorted(scan['message'] for scan in api.check_indexes()) == [
+        "indexed: filter 'source' with sorting 'created' sorts in memory "
+        "(no index on source, created)",
+        "indexed: filter 'source' with sorting 'level' sorts in memory "
+        "(no index on source, level)",
+    ]
+
+
+def test_search(app, api, client):
+
+    @api.route
+    class UserResource(MongoResource):
+
+        class Meta:
+            collection = DB.search
+            filters = 'login',
+            search = True
+            strict = True
+
+    assert 'q' in UserResource.meta.strict
+
+    with app.test_request_context('/api/v1/search?q=mike'):
+        resource = UserResource(api)
+        collection = resource.filter(resource.get_many(), raw=True)
+        collection = resource.search(collection, 'mike bacon')
+        assert collection.query == [{'$text': {'$search': 'mike bacon'}}]
+        assert collection.projection == {'score': {'$meta': 'textScore'}}
+        assert collection.sorting == [('score', {'$meta': 'textScore'})]
+
+        collection = resource.sort(collection, ('login', False))
+        assert collection.sorting == [('login', 1)]
+
+
+def test_bulk(app, api, client):
+    import datetime as dt
+    from flask_restler.sync import Tombstones
+
+    DB.bulk.insert_many([{'login': 'bulk%d' % num, 'role': 'user'} for num in range(3)])
+
+    @api.route
+    class UserResource(MongoResource):
+
+        methods = 'get', 'patch', 'delete'
+
+        class Meta:
+            collection = DB.bulk
+            filters = 'login', 'role'
+            schema = {'login': fields.String(), 'role': fields.String()}
+            bulk = True
+            tombstones = Tombstones()
+
+    response = client.open('/api/v1/bulk?where={"login": {"$in": ["bulk0", "bulk1"]}}',
+                           method='PATCH', data='{"role": "admin"}',
+                           content_type='application/json')
+    assert response.json == {'count': 2}
+    assert DB.bulk.count_documents({'role': 'admin'}) == 2
+
+    response = client.delete('/api/v1/bulk?where={"role": "admin"}&dry_run=1')
+    assert response.json == {'count': 2, 'dry_run': True}
+
+    ids = sorted(str(doc['_id']) for doc in DB.bulk.find({'role': 'admin'}))
+    response = client.delete('/api/v1/bulk?where={"role": "admin"}')
+    assert response.json == {'count': 2}
+    tombstones = UserResource.meta.tombstones.since('bulk', dt.datetime.min)
+    assert sorted(tombstone['_id'] for tombstone in tombstones) == ids
+    assert [doc['login'] for doc in DB.bulk.find()] == ['bulk2']
+
+
+def test_aggregations(app, api, client):
+    DB.orders.insert_many([
+        {'status': 'new', 'amount': 10},
+        {'status': 'paid', 'amount': 20},
+        {'status': 'new', 'amount': 30},
+        {'status': 'canceled', 'amount': 40},
+    ])
+
+    @api.route
+    class OrderResource(MongoResource):
+
+        class Meta:
+            collection = DB.orders
+            filters = 'status',
+            aggregations = 'status', 'amount'
+
+    response = client.get('/api/v1/orders?where={"status": {"$ne": "canceled"}}'
+                          '&group_by=status&agg=count,sum:amount,avg:amount')
+    assert response.json == [
+        {'status': 'new', 'count': 2, 'sum_amount': 40, 'avg_amount': 20},
+        {'status': 'paid', 'count': 1, 'sum_amount': 20, 'avg_amount': 20},
+    ]
+
+    response = client.get('/api/v1/orders?agg=max:amount')
+    assert response.json == [{'max_amount': 40}]
+
+
+def test_sync(app, api, client):
+    import datetime as dt
+    from flask_restler.sync import Tombstones, make_token
+
+    now = dt.datetime.utcnow()
+    DB.notes.insert_many([
+        {'text': 'old', 'updated': now - dt.timedelta(hours=1)},
+        {'text': 'new', 'updated': now},
+    ])
+
+    @api.route
+    class NoteResource(MongoResource):
+
+        methods = 'get', 'delete'
+
+        class Meta:
+            collection = DB.notes
+            schema = {'text': fields.String()}
+            updated_field = 'updated'
+            tombstones = Tombstones()
+
+    response = client.get('/api/v1/notes?since=%s' % make_token(now - dt.timedelta(minutes=1)))
+    assert [note['text'] for note in response.json] == ['new']
+    _id = response.json[0]['_id']
+    token = response.headers['X-Sync-Token']
+
+    response = client.delete('/api/v1/notes/%s' % _id)
+    assert response.status_code == 200
+
+    response = client.get('/api/v1/notes?since=%s' % token)
+    assert response.json == [{'_id': _id, '_deleted': True}]
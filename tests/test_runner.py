@@ -49,3 +49,49 @@ def test_runner(app, api, client):
 
     response = api.run(TestResource, query_string='token=1', method='POST', kwargs=dict(test=2))
     assert response == 'POST'
+
+
+def test_call(app, api):
+    from flask_restler import Resource, APIError
+    from flask_restler.filters import Filter
+
+    data = list(range(10))
+
+    @api.route
+    class TestResource(Resource):
+
+        methods = 'get', 'post'
+
+        class Meta:
+            filters = Filter('num'),
+            sorting = 'num',
+
+        def get_many(self, *args, **kwargs):
+            return data
+
+        def get_one(self, *args, **kwargs):
+            resource = kwargs.get(self.meta.name)
+            if resource is None:
+                return None
+            return data[resource]
+
+        def post(self, *args, **kwargs):
+            if not self.get_data():
+                raise APIError('Invalid data')
+            return self.get_data()
+
+    assert api.call(TestResource) == data
+    assert api.call(TestResource, args={'where': {'num': {'$ge': 8}}}) == [8, 9]
+    assert api.call(TestResource, args={'where': '{"num": 1}'}) == [1]
+    assert api.call(TestResource, args={'per_page': 2, 'page': 1}) == [2, 3]
+    assert api.call(TestResource, kwargs={'test': 3}) == 3
+    assert api.call(TestResource, method='POST', data={'ok': True}) == {'ok': True}
+
+    with pytest.raises(APIError):
+        api.call(TestResource, method='POST')
+
+    assert api.run_many([
+        (TestResource, {}),
+        (TestResource, {'kwargs': {'test': 1}}),
+        (TestResource, {'method': 'POST', 'data': [1]}),
+    ]) == [data, 1, [1]]
@@ -1,4 +1,7 @@
+import datetime as dt
+
 import pytest
+from flask import request
 import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -27,6 +30,41 @@ class User(Model):
     role = sa.orm.relationship(Role)
 
 
+class Team(Model):
+
+    __tablename__ = 'team'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String)
+
+    members = sa.orm.relationship('Member')
+
+
+class Member(Model):
+
+    __tablename__ = 'member'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    team_id = sa.Column(sa.ForeignKey(Team.id))
+
+
+class Payment(Model):
+
+    __tablename__ = 'payment'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    amount = sa.Column(sa.Numeric(10, 2))
+
+
+class Note(Model):
+
+    __tablename__ = 'note'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    text = sa.Column(sa.String)
+    updated = sa.Column(sa.DateTime, default=dt.datetime.utcnow, onupdate=dt.datetime.utcnow)
+
+
 @pytest.fixture(scope='session')
 def sa_engine():
     from sqlalchemy import create_engine
@@ -110,14 +148,538 @@ def test_resource(app, api, client, sa_session):
     assert len(response.json) == 1
     assert response.json[0]['login'] == 'dave'
 
+    response = app.test_client().get(
+        '/api/v1/user?sort=-login&fields=login&where={"login": {"$like": "%e%"}}',
+        headers={'Accept': 'text/csv'})
+    assert response.data.decode().splitlines() == ['login', 'mike', 'dave']
+
     response = client.delete('/api/v1/user/1')
     assert not response.json
 
     response = client.get('/api/v1/user')
     assert len(response.json) == 1
 
+    response = app.test_client().get(
+        '/api/v1/user', headers={'Accept': 'application/x-ndjson'})
+    assert response.mimetype == 'application/x-ndjson'
+    assert len(response.data.splitlines()) == 1
+
     response = client.get('/api/v1/user?where={"role": "test"}')
     assert len(response.json) == 1
 
     response = client.get('/api/v1/user?where={"role": "unknown"}')
     assert not response.json
+
+
+def test_unit_of_work(app, api, client, sa_session):
+    from flask_restler import APIError, route
+    from flask_restler.sqlalchemy import ModelResource
+
+    calls = []
+
+    def get_session():
+        calls.append(1)
+        return sa_session
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'post', 'put', 'delete'
+
+        class Meta:
+            model = User
+            session = get_session
+            schema_exclude = 'password',
+
+        @route('/fail', methods=['POST'])
+        def fail(self, **kwargs):
+            self.save(self.load(request.json))
+            raise APIError('Rollback')
+
+    total = sa_session.query(User).count()
+    del calls[:]
+
+    response = client.post_json('/api/v1/user', {'login': 'uow'})
+    assert response.json['id']
+    assert calls == [1]
+    assert sa_session.query(User).count() == total + 1
+
+    response = client.post_json('/api/v1/user/fail', {'login': 'failed'})
+    assert response.status_code == 400
+    assert sa_session.query(User).count() == total + 1
+    assert not sa_session.query(User).filter(User.login == 'failed').count()
+
+
+def test_read_replicas(app, api, client, tmpdir):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from flask_restler.sqlalchemy import ModelResource
+
+    sessions = []
+    for name in ('primary', 'replica'):
+        engine = create_engine('sqlite:///%s' % tmpdir.join('%s.db' % name))
+        Model.metadata.create_all(engine)
+        sessions.append(sessionmaker(bind=engine)())
+
+    primary, replica = sessions
+    replica.add(User(login='replica'))
+    replica.commit()
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'post'
+
+        class Meta:
+            model = User
+            session = primary
+            read_session = [lambda: replica]
+            read_your_writes = 60
+            schema_exclude = 'password',
+
+    response = client.get('/api/v1/user')
+    assert [u['login'] for u in response.json] == ['replica']
+    assert response.headers['X-Total-Count'] == '1'
+
+    response = client.post_json('/api/v1/user', {'login': 'primary'})
+    assert response.json['login'] == 'primary'
+    assert primary.query(User).count() == 1
+
+    # Read your writes
+    response = client.get('/api/v1/user')
+    assert [u['login'] for u in response.json] == ['primary']
+
+    UserResouce.meta.read_session.writes.clear()
+    response = client.get('/api/v1/user')
+    assert [u['login'] for u in response.json] == ['replica']
+
+
+def test_read_rows(app, api, client, sa_session):
+    from flask_restler.sqlalchemy import ModelResource
+
+    role = Role(name='rows')
+    sa_session.add(role)
+    sa_session.add_all([
+        User(login='rows%d' % num, name='Rows %d' % num, role=num % 2 and role or None)
+        for num in range(5)])
+    sa_session.commit()
+
+    def make_resource(name, **options):
+        meta = type('Meta', (object,), dict(
+            model=User, session=lambda: sa_session, filters=('login',), sorting=('login',),
+            schema_exclude=('password',), name=name, **options))
+        return api.route(type(name.title() + 'Resource', (ModelResource,), {'Meta': meta}))
+
+    make_resource('orm')
+    UserRowsResource = make_resource('rows', read_mode='rows')
+    UserCompiledResource = make_resource('compiled', read_mode='rows', compile_schema=True)
+
+    assert UserRowsResource.meta.read_mode == 'rows'
+    assert UserCompiledResource.meta.row_dumper
+
+    query = '?where={"login": {"$like": "rows%"}}&sort=-login&per_page=3&page=1'
+    expected = client.get('/api/v1/orm' + query).json
+    assert [user['login'] for user in expected] == ['rows1', 'rows0']
+    assert expected[0]['role'] == role.id
+    assert 'password' not in expected[0]
+
+    sa_session.expunge_all()
+    response = client.get('/api/v1/rows' + query)
+    assert response.json == expected
+    assert response.headers['X-Total-Count'] == '5'
+    assert not list(sa_session)
+
+    response = client.get('/api/v1/compiled' + query)
+    assert response.json == expected
+
+    response = client.get('/api/v1/rows/%d' % expected[0]['id'])
+    assert response.json == expected[0]
+
+    from marshmallow import fields
+
+    @api.route
+    class RoleResource(ModelResource):
+
+        class Meta:
+            model = Role
+            read_mode = 'rows'
+            schema = {'title': fields.Function(lambda role: role.name.title())}
+
+    assert RoleResource.meta.read_mode == 'orm'
+
+
+def test_check_indexes(app, api, client, sa_session, sa_engine):
+    from flask_restler.sqlalchemy import ModelResource, Filter
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            filters = 'id', 'login', 'name', Filter('role', mfield=Role.name)
+            sorting = 'login', User.name
+
+    def messages():
+        return sorted(scan['message'] for scan in api.check_indexes(UserResouce))
+
+    assert messages() == [
+        "user: filter 'login' scans table 'user' (no index on login)",
+        "user: filter 'name' scans table 'user' (no index on name)",
+        "user: filter 'role' scans table 'role' (no index on name)",
+        "user: sorting 'login' sorts table 'user' in memory (no index on login)",
+        "user: sorting 'name' sorts table 'user' in memory (no index on name)",
+    ]
+
+    sa.Index('ix_user_login', User.login).create(sa_engine)
+    sa.Index('ix_user_name_login', User.name, User.login).create(sa_engine)
+    assert messages() == [
+        "user: filter 'login' with sorting 'name' sorts in memory (no index on login, name)",
+        "user: filter 'role' scans table 'role' (no index on name)",
+    ]
+
+
+def test_search(app, api, client, sa_session, sa_engine):
+    from sqlalchemy.dialects import postgresql
+    from flask_restler.sqlalchemy import ModelResource, FTS5
+
+    sa_session.add_all([
+        User(login='search%d' % num, name=name) for num, name in enumerate((
+            'Mike Bacon', 'Bob Bacon', 'Mike Tyson', 'Bacon "Crispy" Strips'))])
+    sa_session.commit()
+
+    sa_engine.execute('CREATE VIRTUAL TABLE user_fts USING fts5(name)')
+    sa_engine.execute('INSERT INTO user_fts (rowid, name) SELECT id, name FROM user')
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            filters = 'login',
+            sorting = 'login',
+            search = FTS5('user_fts')
+            strict = True
+
+    response = client.get('/api/v1/user?q=bacon')
+    assert sorted(user['login'] for user in response.json) == ['search0', 'search1', 'search3']
+
+    response = client.get('/api/v1/user?q=mike bacon')
+    assert [user['login'] for user in response.json] == ['search0']
+
+    response = client.get('/api/v1/user?q="crispy')
+    assert [user['login'] for user in response.json] == ['search3']
+
+    response = client.get('/api/v1/user?q=bacon&where={"login": {"$ne": "search1"}}&per_page=1')
+    assert len(response.json) == 1
+    assert response.headers['X-Total-Count'] == '2'
+
+    response = client.get('/api/v1/user?q=bacon&sort=-login')
+    assert [user['login'] for user in response.json] == ['search3', 'search1', 'search0']
+
+    response = client.get('/api/v1/user?where={"login": {"$like": "search%"}}&q=')
+    assert len(response.json) == 4
+
+    class UserVectorResouce(ModelResource):
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            search = 'name',
+
+    # Postgres full-text search accepts plain user input
+    query = UserVectorResouce(api).search(sa_session.query(User.id), 'mike bacon')
+    assert '"user".name @@ plainto_tsquery(' in str(
+        query.statement.compile(dialect=postgresql.dialect()))
+
+
+def test_fast_patch(app, api, client, sa_session, sa_engine):
+    from flask_restler.sqlalchemy import ModelResource
+
+    role = Role(name='patch')
+    user = User(login='patch', name='Patch')
+    sa_session.add_all([role, user])
+    sa_session.commit()
+    user_id, role_id = user.id, role.id
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'patch'
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            schema_exclude = 'password',
+            fast_patch = True
+
+    statements = []
+
+    @sa.event.listens_for(sa_engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, *args):
+        statements.append(statement.split()[0])
+
+    response = client.open(
+        '/api/v1/user/%d' % user_id, method='PATCH', data='{"name": "Mike", "role": %d}' % (
+            role_id), content_type='application/json', headers={'Prefer': 'return=minimal'})
+    assert response.status_code == 204
+    assert not response.data
+    assert statements == ['UPDATE']
+
+    del statements[:]
+    response = client.open('/api/v1/user/%d' % user_id, method='PATCH', data='{"name": "Bob"}',
+                           content_type='application/json')
+    assert statements[:1] == ['UPDATE']
+    assert response.json['name'] == 'Bob'
+    assert response.json['login'] == 'patch'
+    assert response.json['role'] == role_id
+
+    sa.event.remove(sa_engine, 'before_cursor_execute', count)
+
+    response = client.open('/api/v1/user/%d' % user_id, method='PATCH', data='{}',
+                           content_type='application/json')
+    assert response.json['name'] == 'Bob'
+
+    response = client.open('/api/v1/user/0', method='PATCH', data='{"name": "Tom"}',
+                           content_type='application/json')
+    assert response.status_code == 404
+
+    response = client.open('/api/v1/user/%d' % user_id, method='PATCH', data='{"login": []}',
+                           content_type='application/json')
+    assert response.status_code == 400
+
+    @api.route
+    class JoinedResouce(ModelResource):
+
+        methods = 'get', 'patch'
+
+        class Meta:
+            model = User
+            name = 'joined'
+            session = lambda: sa_session  # noqa
+            schema_exclude = 'password',
+            fast_patch = True
+
+        def get_many(self, **kwargs):
+            return self.session.query(User).outerjoin(Role).filter(Role.name == 'patch')
+
+    response = client.open('/api/v1/joined/%d' % user_id, method='PATCH', data='{"name": "Tom"}',
+                           content_type='application/json')
+    assert response.status_code == 200
+    assert response.json['name'] == 'Tom'
+
+    team, member = Team(name='patch'), Member()
+    sa_session.add_all([team, member])
+    sa_session.commit()
+
+    @api.route
+    class TeamResouce(ModelResource):
+
+        methods = 'get', 'patch'
+
+        class Meta:
+            model = Team
+            session = lambda: sa_session  # noqa
+            fast_patch = True
+
+    response = client.open('/api/v1/team/%d' % team.id, method='PATCH',
+                           data='{"members": [%d]}' % member.id, content_type='application/json')
+    assert response.status_code == 400
+    assert 'members' in response.json['errors']
+
+
+def test_bulk(app, api, client, sa_session, sa_engine):
+    from flask_restler.sqlalchemy import ModelResource, Filter
+    from flask_restler.sync import Tombstones
+
+    role = Role(name='bulk')
+    sa_session.add(role)
+    sa_session.add_all([User(login='bulk%d' % num, name='Bulk') for num in range(5)])
+    sa_session.commit()
+    role_id = role.id
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        methods = 'get', 'patch', 'delete'
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            filters = 'login', 'name'
+            bulk = True
+            bulk_limit = 4
+
+    where = '?where={"name": "Bulk", "login": {"$ne": "bulk0"}}'
+    response = client.delete('/api/v1/user' + where + '&dry_run=1')
+    assert response.json == {'count': 4, 'dry_run': True}
+
+    statements = []
+
+    @sa.event.listens_for(sa_engine, 'before_cursor_execute')
+    def count(conn, cursor, statement, *args):
+        statements.append(statement.split()[0])
+
+    response = client.open('/api/v1/user' + where, method='PATCH',
+                           data='{"password": "bulk", "role": %d}' % role_id,
+                           content_type='application/json')
+    assert response.json == {'count': 4}
+    assert statements == ['SELECT', 'SELECT', 'UPDATE']  # the role, the cap, the update
+
+    sa.event.remove(sa_engine, 'before_cursor_execute', count)
+
+    users = sa_session.query(User).filter(User.password == 'bulk').all()
+    assert sorted(user.login for user in users) == ['bulk1', 'bulk2', 'bulk3', 'bulk4']
+    assert {user.role_id for user in users} == {role_id}
+
+    response = client.delete('/api/v1/user?where={"name": "Bulk"}')
+    assert response.status_code == 400
+
+    @api.route
+    class UnlimitedResouce(ModelResource):
+
+        methods = 'delete',
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            name = 'unlimited'
+            filters = 'id', 'login', 'unknown'
+            bulk = True
+            bulk_limit = None
+
+    count = sa_session.query(User).count()
+    for where_ in ('{"login": {"$bogus": "x"}}', '{"id": {"$eq": "notanint"}}',
+                   '{"id": "notanint"}', '{"login": {"$ne": "bulk0", "$bogus": "x"}}',
+                   '{"unknown": "x"}', '{"unknown": {"$ne": "x"}}'):
+        response = client.delete('/api/v1/unlimited?where=' + where_)
+        assert response.status_code == 400, where_
+    assert sa_session.query(User).count() == count
+    assert sa_session.query(User).filter(User.name == 'Bulk').count() == 5
+
+    response = client.delete('/api/v1/user' + where)
+    assert response.json == {'count': 4}
+    assert [user.login for user in sa_session.query(User).filter(User.name == 'Bulk')] == [
+        'bulk0']
+
+    @api.route
+    class JoinedResouce(ModelResource):
+
+        methods = 'patch', 'delete'
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            name = 'joined'
+            filters = Filter('role', mfield=Role.name),
+            bulk = True
+            tombstones = Tombstones()
+
+        def get_many(self, **kwargs):
+            return sa_session.query(User).outerjoin(User.role)
+
+    joined = [User(login='joined%d' % num, role=role) for num in range(2)]
+    sa_session.add_all(joined)
+    sa_session.commit()
+    ids = sorted(user.id for user in joined)
+
+    response = client.open('/api/v1/joined?where={"role": "bulk"}', method='PATCH',
+                           data='{"name": "Joined"}', content_type='application/json')
+    assert response.json == {'count': 2}
+
+    response = client.delete('/api/v1/joined?where={"role": "bulk"}')
+    assert response.json == {'count': 2}
+    assert sa_session.query(User).filter(User.role_id == role_id).count() == 0
+    tombstones = JoinedResouce.meta.tombstones.since('joined', dt.datetime.min)
+    assert sorted(tombstone['id'] for tombstone in tombstones) == ids
+
+
+def test_aggregations(app, api, client, sa_session):
+    from flask_restler.sqlalchemy import ModelResource
+
+    role = Role(name='aggregate')
+    sa_session.add(role)
+    sa_session.add_all([
+        User(login='agg%d' % num, name='Aggregate', role=num % 2 and role or None)
+        for num in range(5)])
+    sa_session.commit()
+
+    @api.route
+    class UserResouce(ModelResource):
+
+        class Meta:
+            model = User
+            session = lambda: sa_session  # noqa
+            filters = 'name',
+            aggregations = 'role_id', User.login
+
+    response = client.get(
+        '/api/v1/user?where={"name": "Aggregate"}&group_by=role_id&agg=count,max:login')
+    assert response.json == [
+        {'role_id': None, 'count': 3, 'max_login': 'agg4'},
+        {'role_id': role.id, 'count': 2, 'max_login': 'agg3'},
+    ]
+
+    response = client.get('/api/v1/user?where={"name": "Aggregate"}&agg=count,min:login')
+    assert response.json == [{'count': 5, 'min_login': 'agg0'}]
+
+    sa_session.add_all([Payment(amount=amount) for amount in ('10.50', '2.25')])
+    sa_session.commit()
+
+    @api.route
+    class PaymentResouce(ModelResource):
+
+        class Meta:
+            model = Payment
+            session = lambda: sa_session  # noqa
+            aggregations = 'amount',
+
+    response = client.get('/api/v1/payment?agg=sum:amount,max:amount')
+    assert response.json == [{'sum_amount': 12.75, 'max_amount': 10.5}]
+
+    response = client.get('/api/v1/payment')
+    assert sorted(payment['amount'] for payment in response.json) == [2.25, 10.5]
+
+
+def test_sync(app, api, client, sa_session, monkeypatch):
+    from flask_restler.sqlalchemy import ModelResource
+    from flask_restler.sync import Tombstones, make_token
+
+    past = dt.datetime.utcnow() - dt.timedelta(hours=1)
+    sa_session.add_all([Note(text='old', updated=past), Note(text='new'), Note(text='deleted')])
+    sa_session.commit()
+    deleted_id = sa_session.query(Note.id).filter(Note.text == 'deleted').scalar()
+
+    @api.route
+    class NoteResource(ModelResource):
+
+        methods = 'get', 'delete'
+
+        class Meta:
+            model = Note
+            session = lambda: sa_session  # noqa
+            updated_field = 'updated'
+            tombstones = Tombstones()
+
+    response = client.get('/api/v1/note?since=%s' % make_token(past + dt.timedelta(minutes=1)))
+    assert sorted(note['text'] for note in response.json) == ['deleted', 'new']
+    token = response.headers['X-Sync-Token']
+
+    # Tombstones are recorded only when the changes are committed
+    def fail():
+        raise RuntimeError('commit failed')
+
+    with monkeypatch.context() as patch:
+        patch.setattr(sa_session, 'commit', fail)
+        with pytest.raises(RuntimeError):
+            client.delete('/api/v1/note/%d' % deleted_id)
+
+    assert sa_session.query(Note).get(deleted_id)
+    assert client.get('/api/v1/note?since=%s' % token).json == []
+
+    response = client.delete('/api/v1/note/%d' % deleted_id)
+    assert response.status_code == 200
+
+    response = client.get('/api/v1/note?since=%s' % token)
+    assert response.json == [{'id': deleted_id, '_deleted': True}]